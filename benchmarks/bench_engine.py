@@ -0,0 +1,48 @@
+"""
+Ticks per second of the object path against the numpy engine for growing armies
+Run from the repository root so the assets folder is found: python benchmarks/bench_engine.py
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import main
+
+SIZES = (100, 1000, 10000)
+TIME_BUDGET = 3.0 # seconds per measurement, slow configurations just run fewer ticks
+MAX_TICKS = 300
+
+def battle(size, engine):
+    """
+    Half imps in the middle, half knights around them, already far above what trigger_wave tops up to
+    """
+    world = main.World(seed = 0, engine = engine)
+    rng = random.Random(size)
+    for _ in range(size//2):
+        world.summon(main.Imp, rng.uniform(156, 356), rng.uniform(156, 356))
+    for _ in range(size - size//2):
+        world.spawn(main.Knight(rng.uniform(0, main.WIDTH), rng.uniform(0, main.HEIGHT)))
+    return world
+
+def ticks_per_second(size, engine):
+    world = battle(size, engine)
+    world.step() # Warm up caches
+    ticks = 0
+    start = time.perf_counter()
+    while ticks < MAX_TICKS and time.perf_counter() - start < TIME_BUDGET:
+        world.step()
+        ticks += 1
+    return ticks / (time.perf_counter() - start)
+
+def main_benchmark():
+    print("%8s %14s %14s %8s" % ("entities", "objects t/s", "numpy t/s", "speedup"))
+    for size in SIZES:
+        objects = ticks_per_second(size, "objects")
+        numpy = ticks_per_second(size, "numpy")
+        print("%8d %14.1f %14.1f %7.1fx" % (size, objects, numpy, numpy / objects))
+
+if __name__ == "__main__":
+    main_benchmark()
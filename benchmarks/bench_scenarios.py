@@ -0,0 +1,165 @@
+"""
+Scripted headless scenarios timing the game logic tick by tick, for catching slowdowns in movement, targeting and combat
+Run from the repository root so the assets folder is found:
+    python benchmarks/bench_scenarios.py --save results.json
+    python benchmarks/bench_scenarios.py --baseline results.json
+With --baseline, exits with status 1 if any scenario lost more ticks/s or gained more peak memory than --threshold
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import main
+
+TICKS = 300
+REPEAT = 3 # Runs per scenario, the fastest is kept since slower ones only add noise from the rest of the machine
+TOUGH = {"hp": 1000.0} # For allies that should last the whole scenario
+
+def quiet_world(engine, unit_stats = None):
+    """
+    A world where trigger_wave never adds enemies, so only the scripted armies fight
+    """
+    world = main.World(seed = 0, engine = engine, difficulty_ramp = 0.0, unit_stats = unit_stats)
+    world.difficulty = 0.0
+    return world
+
+def scatter(world, unit_type, count, rng, area = (0, 0, main.WIDTH, main.HEIGHT)):
+    left, top, right, bottom = area
+    for _ in range(count):
+        world.summon(unit_type, rng.uniform(left, right), rng.uniform(top, bottom))
+
+def idle_imps(engine, count = 500):
+    world = quiet_world(engine)
+    scatter(world, main.Imp, count, random.Random(1))
+    return world
+
+def chasing_imps(engine, count = 500):
+    world = quiet_world(engine)
+    scatter(world, main.Imp, count, random.Random(2))
+    world.move_allies(main.WIDTH - 20, main.HEIGHT - 20)
+    return world
+
+def melee(engine, count = 200):
+    world = quiet_world(engine)
+    rng = random.Random(3)
+    scatter(world, main.Imp, count, rng, (156, 156, 356, 356))
+    scatter(world, main.Knight, count, rng)
+    return world
+
+def arrow_storm(engine, count = 100):
+    world = quiet_world(engine, {"Imp": TOUGH})
+    rng = random.Random(4)
+    scatter(world, main.Imp, 50, rng, (206, 206, 306, 306))
+    scatter(world, main.Elf, count, rng)
+    return world
+
+def necromancers(engine, count = 20):
+    """
+    Skeletons keep being summoned for the whole run
+    """
+    world = quiet_world(engine, {"Imp": TOUGH})
+    rng = random.Random(5)
+    scatter(world, main.Imp, 20, rng, (206, 206, 306, 306))
+    scatter(world, main.Necromancer, count, rng)
+    return world
+
+def fireball_barrage(engine, count = 50):
+    world = quiet_world(engine, {"Imp": TOUGH})
+    rng = random.Random(6)
+    scatter(world, main.Imp, 50, rng, (206, 206, 306, 306))
+    scatter(world, main.Wizard, count, rng)
+    return world
+
+SCENARIOS = {"idle_imps": idle_imps, "chasing_imps": chasing_imps, "melee_200v200": melee,
+             "arrow_storm": arrow_storm, "necromancers": necromancers, "fireball_barrage": fireball_barrage}
+
+def run(scenario, engine, ticks = TICKS, repeat = REPEAT):
+    """
+    Times every tick of the fastest of repeat runs, then replays the scenario under tracemalloc for its peak Python memory,
+    which leaves out pixel data SDL allocates itself
+    """
+    tick_times = None
+    for _ in range(repeat):
+        world = SCENARIOS[scenario](engine)
+        times = []
+        for _ in range(ticks):
+            start = time.perf_counter()
+            world.step()
+            times.append(time.perf_counter() - start)
+        if tick_times is None or sum(times) < sum(tick_times):
+            tick_times = times
+    entities = len(world.registry.all)
+
+    tracemalloc.start()
+    world = SCENARIOS[scenario](engine)
+    for _ in range(ticks):
+        world.step()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tick_times.sort()
+    return {"ticks": ticks,
+            "entities_at_end": entities,
+            "ticks_per_second": round(ticks / sum(tick_times), 2),
+            "p50_ms": round(tick_times[len(tick_times) // 2] * 1000, 4),
+            "p99_ms": round(tick_times[min(len(tick_times) - 1, int(len(tick_times) * .99))] * 1000, 4),
+            "peak_memory_kb": round(peak / 1024, 1)}
+
+def compare(results, baseline, threshold):
+    """
+    Returns a line for every scenario that is slower or heavier than the baseline by more than threshold
+    """
+    regressions = []
+    for scenario, result in results.items():
+        before = baseline.get(scenario)
+        if before is None:
+            continue
+        if result["ticks_per_second"] < before["ticks_per_second"] * (1 - threshold):
+            regressions.append("%s: %.1f ticks/s, baseline %.1f" % (scenario, result["ticks_per_second"], before["ticks_per_second"]))
+        if result["peak_memory_kb"] > before["peak_memory_kb"] * (1 + threshold):
+            regressions.append("%s: %.1f KB peak, baseline %.1f" % (scenario, result["peak_memory_kb"], before["peak_memory_kb"]))
+    return regressions
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", default = "objects")
+    parser.add_argument("--ticks", type = int, default = TICKS)
+    parser.add_argument("--repeat", type = int, default = REPEAT)
+    parser.add_argument("--only", help = "Comma separated scenarios, any of " + ", ".join(SCENARIOS))
+    parser.add_argument("--save", metavar = "PATH", help = "Write the results as JSON")
+    parser.add_argument("--baseline", metavar = "PATH", help = "JSON from an earlier --save to compare against")
+    parser.add_argument("--threshold", type = float, default = .1, help = "Allowed fraction of slowdown or memory growth")
+    args = parser.parse_args()
+
+    scenarios = args.only.split(",") if args.only else list(SCENARIOS)
+    results = {}
+    print("%-18s %9s %12s %9s %9s %10s" % ("scenario", "entities", "ticks/s", "p50 ms", "p99 ms", "peak KB"))
+    for scenario in scenarios:
+        result = results[scenario] = run(scenario, args.engine, args.ticks, args.repeat)
+        print("%-18s %9d %12.1f %9.3f %9.3f %10.1f" % (scenario, result["entities_at_end"], result["ticks_per_second"],
+                                                      result["p50_ms"], result["p99_ms"], result["peak_memory_kb"]))
+
+    if args.save:
+        with open(args.save, "w") as output:
+            json.dump({"engine": args.engine, "python": platform.python_version(), "scenarios": results}, output, indent = 2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["engine"] != args.engine:
+            print("Baseline was measured with engine", baseline["engine"] + ", not", args.engine)
+        regressions = compare(results, baseline["scenarios"], args.threshold)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions past", args.threshold)
+
+if __name__ == "__main__":
+    main_benchmark()
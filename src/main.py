@@ -10,65 +10,820 @@ Font Asset by Poppy Works @ https://poppyworks.itch.io/silver?download
 Particle Assets by Will Tice @ https://untiedgames.itch.io/five-free-pixel-explosions
 """
 
+import gc
+import heapq
+import itertools
+import json
 import math
 import os
 import random
+import sys
+import time
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 import pygame
+import recording
+import snapshot
 
 WIDTH, HEIGHT = 512, 512
-WINDOW = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Battles")
-
-PLACEHOLDER = pygame.image.load(os.path.join("assets", "crate.png")).convert_alpha()
-BG = pygame.transform.scale(pygame.image.load(os.path.join("assets", "dungeon.png")).convert_alpha(), (WIDTH, HEIGHT))
-COIN = pygame.transform.scale(pygame.image.load(os.path.join("assets", "coin.png")).convert_alpha(), (12, 15))
-IMP = pygame.image.load(os.path.join("assets", "imp_idle_anim_f0.png")).convert_alpha()
-WOGOL = pygame.image.load(os.path.join("assets", "wogol_idle_anim_f0.png")).convert_alpha()
-CHORT = pygame.image.load(os.path.join("assets", "chort_idle_anim_f0.png")).convert_alpha()
-BIG_DEMON = pygame.image.load(os.path.join("assets", "big_demon_idle_anim_f0.png")).convert_alpha()
-
-coins = 0
-difficulty = 1.0
 FPS = 60
 
-all_sprites = []
-ally_sprites = []
-enemy_sprites = []
+# Indices into the pre-baked variants of a unit frame, flipped and tinted are bit flags
+NORMAL = 0
+FLIPPED = 1
+TINTED = 2
+FLIPPED_TINTED = FLIPPED | TINTED
+
+class AssetCache:
+    """
+    Process-wide image cache so every file is decoded and converted exactly once
+    Animations are handed out as tuples shared by every instance of a unit type, never modify them
+    Frames packed by tools/pack_atlas.py are served as subsurfaces of their sheet instead of separate files
+    start_preload() decodes every file on worker threads ahead of time, once sealed any file that was missed raises instead of being read
+    """
+    def __init__(self, directory: str = "assets", atlas: str = os.path.join("atlas", "atlas.json")):
+        self.directory = directory
+        self.atlas_index = atlas
+        self.atlas = None # path -> (sheet, rect), empty if no atlas was built
+        self.images = {} # path -> surface
+        self.decoded = {} # path -> converted surface that was preloaded but not asked for yet
+        self.pending = {} # decoding future -> path
+        self.preload_total = 0
+        self.sealed = False
+        self.animations = {} # (folder, file prefix, first frame, frame count) -> tuple of surfaces
+        self.variants = {} # unit frame -> (normal, flipped, tinted, flipped tinted)
+        self.shadows = {} # unit frame -> shadow ellipse as wide as it
+        self.ellipses = {} # (width, height, color) -> surface
+        self.numberings = {} # id(first frames) -> (first frames, second frames, {frame: its index in first + second frames})
+        self.hits = 0
+        self.misses = 0
+        self.files_loaded = 0
+        self.surfaces_created = 0 # every surface the cache has ever made, should stay flat during play
+        self.load_time = 0.0 # seconds the main thread spent decoding and converting
+
+    def load(self, path):
+        image = self.decoded.pop(path, None)
+        if image is not None:
+            return image
+        if self.sealed:
+            raise RuntimeError(path + " was not preloaded, it would have been read from disk during play")
+        start = time.perf_counter()
+        image = self.convert(pygame.image.load(path))
+        self.load_time += time.perf_counter() - start
+        self.files_loaded += 1
+        return image
+
+    def convert(self, image):
+        if pygame.display.get_surface() is not None: # Headless worlds only need the image sizes
+            image = image.convert_alpha()
+        self.surfaces_created += 1
+        return image
+
+    def read_atlas_index(self):
+        """
+        Returns (folder of the sheets, index) or None if no atlas was built
+        """
+        index_path = os.path.join(self.directory, self.atlas_index)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path) as index_file:
+            return os.path.dirname(index_path), json.load(index_file)
+
+    def load_atlas(self):
+        """
+        Decodes every sheet listed in the atlas index once. Returns False if there is no atlas
+        """
+        self.atlas = {}
+        atlas = self.read_atlas_index()
+        if atlas is None:
+            return False
+        folder, index = atlas
+        sheets = [self.load(os.path.join(folder, name)) for name in index["sheets"]]
+        for path, (sheet, x, y, width, height) in index["frames"].items():
+            self.atlas[os.path.join(self.directory, *path.split("/"))] = (sheets[sheet], pygame.Rect(x, y, width, height))
+        return True
+
+    def start_preload(self, workers: int = 4):
+        """
+        Starts decoding every image under the directory on a thread pool, the atlas sheets instead of the frames packed into them.
+        Call poll_preload() from the main thread until it returns 1.0
+        """
+        paths = []
+        packed = set()
+        atlas = self.read_atlas_index()
+        if atlas is not None:
+            folder, index = atlas
+            paths += [os.path.join(folder, name) for name in index["sheets"]]
+            packed = {os.path.join(self.directory, *path.split("/")) for path in index["frames"]}
+        for root, folders, files in os.walk(self.directory):
+            folders.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if name.endswith(".png") and path not in packed and path not in paths and path not in self.images:
+                    paths.append(path)
+
+        pool = ThreadPoolExecutor(workers)
+        self.pending = {pool.submit(pygame.image.load, path): path for path in paths}
+        self.preload_total = len(paths)
+        pool.shutdown(wait = False)
+
+    def poll_preload(self):
+        """
+        Converts the images that finished decoding since the last call, which has to happen on the main thread.
+        Returns the fraction of the preload done
+        """
+        for future in [future for future in self.pending if future.done()]:
+            path = self.pending.pop(future)
+            start = time.perf_counter()
+            self.decoded[path] = self.convert(future.result())
+            self.load_time += time.perf_counter() - start
+            self.files_loaded += 1
+        return 1.0 - len(self.pending) / self.preload_total if self.preload_total else 1.0
+
+    def seal(self):
+        """
+        From now on a file that was not preloaded raises instead of being read from disk
+        """
+        self.sealed = True
+
+    def image(self, *path):
+        path = os.path.join(self.directory, *path)
+        image = self.images.get(path)
+        if image is None:
+            if self.atlas is None:
+                self.load_atlas()
+            packed = self.atlas.get(path)
+            if packed is not None:
+                sheet, rect = packed
+                image = sheet.subsurface(rect)
+                self.surfaces_created += 1
+            else:
+                image = self.load(path)
+            self.images[path] = image
+        return image
 
-class Sprite(pygame.sprite.Sprite):
-    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = PLACEHOLDER):
-        pygame.sprite.Sprite.__init__(self)
-        self.pos = pygame.math.Vector2(x, y)
+    def sequence(self, prefix: str, count: int, first: int = 0, folder: str = ""):
+        """
+        Returns the frames assets/<folder>/<prefix><n>.png for n in [first, first + count)
+        """
+        key = (folder, prefix, first, count)
+        frames = self.animations.get(key)
+        if frames is None:
+            self.misses += 1
+            frames = tuple(self.image(folder, prefix + str(i) + ".png") for i in range(first, first + count))
+            self.animations[key] = frames
+        else:
+            self.hits += 1
+        return frames
+
+    def frames(self, unit: str, animation: str, first: int = 0, count: int = 4):
+        """
+        Returns the frames of assets/<unit>_<animation>_anim_f<n>.png, with their variants baked
+        """
+        frames = self.sequence(unit + "_" + animation + "_anim_f", count, first)
+        for frame in frames:
+            if frame not in self.variants:
+                self.bake_variants(frame)
+        return frames
+
+    def frame_numbers(self, first, second = ()):
+        """
+        Returns {frame: index} numbering the frames of first and then second, e.g. a unit's idle and run animations.
+        Snapshots save these numbers in place of the frame shown
+        """
+        # Keyed by id because hashing the tuples every call would cost most of what the lookup saves,
+        # the entry holds on to them so the id cannot be reused while it is there
+        entry = self.numberings.get(id(first))
+        if entry is None or entry[0] is not first or entry[1] is not second:
+            numbers = {frame: i for i, frame in reversed(list(enumerate(first + second)))} # First one wins, like index()
+            entry = self.numberings[id(first)] = (first, second, numbers)
+        return entry[2]
+
+    def bake_variants(self, frame):
+        """
+        Pre-renders the mirrored and damage-tinted versions of a frame and picks its shadow so drawing never allocates
+        """
+        tinted = frame.copy()
+        tinted.fill((255, 0, 0), special_flags = pygame.BLEND_MULT)
+        self.variants[frame] = (frame, pygame.transform.flip(frame, True, False), tinted, pygame.transform.flip(tinted, True, False))
+        self.surfaces_created += 3
+        self.shadows[frame] = self.ellipse(frame.get_width(), SHADOW_HEIGHT, SHADOW_COLOR)
+
+    def ellipse(self, width: int, height: int, color):
+        """
+        Returns a filled ellipse keyed out of its bounding box, blitting it gives the same pixels as pygame.draw.ellipse.
+        A colour key rather than per pixel alpha, so the blit is a run length encoded copy instead of a blend
+        """
+        key = (width, height, color)
+        image = self.ellipses.get(key)
+        if image is None:
+            image = pygame.Surface((width, height))
+            transparent = (255, 0, 255) if color != (255, 0, 255) else (0, 0, 0)
+            image.fill(transparent)
+            pygame.draw.ellipse(image, color, image.get_rect())
+            image.set_colorkey(transparent, pygame.RLEACCEL)
+            self.ellipses[key] = image
+            self.surfaces_created += 1
+        return image
+
+ASSETS = AssetCache()
+
+class TextCache:
+    """
+    Rendered text surfaces keyed by (font, text, colour), the least recently used are dropped past capacity
+    Like animation frames, the surfaces are shared, never modify them
+    """
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self.labels = OrderedDict() # (font, text, colour, antialias) -> surface, oldest first
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font: pygame.font.Font, text: str, colour, antialias: bool = True):
+        key = (font, text, colour, antialias)
+        label = self.labels.get(key)
+        if label is None:
+            self.misses += 1
+            label = font.render(text, antialias, colour)
+            self.labels[key] = label
+            if len(self.labels) > self.capacity:
+                self.labels.popitem(last = False)
+        else:
+            self.hits += 1
+            self.labels.move_to_end(key)
+        return label
+
+TEXT = TextCache()
+
+class Profiler:
+    """
+    Splits every frame into named phases, mark(phase) charges the time since the previous mark to it
+    While disabled every call returns straight away, so the calls stay in the loop for good
+    The last few hundred frames are kept for the overlay, and every frame can be streamed to a CSV or JSON lines trace
+    """
+    def __init__(self, history: int = 300):
+        self.enabled = False
+        self.overlay = False
+        self.history = deque(maxlen = history) # (frame seconds, {phase: seconds}, {counter: value})
+        self.phases = {}
+        self.counts = {}
+        self.frame = 0
+        self.frame_start = 0.0
+        self.last = 0.0
+        self.allocated = 0 # Surfaces made by the caches so far
+        self.trace = None
+        self.trace_json = False
+
+    def enable(self):
+        self.enabled = True
+        self.allocated = ASSETS.surfaces_created + TEXT.misses
+        self.begin_frame()
+
+    def disable(self):
+        self.enabled = False
+        self.overlay = False
+        self.stop_trace()
+
+    def toggle_overlay(self):
+        if self.overlay:
+            self.overlay = False
+        else:
+            if not self.enabled:
+                self.enable()
+            self.overlay = True
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.phases = {}
+        self.counts = {}
+        self.frame_start = self.last = time.perf_counter()
+
+    def mark(self, phase: str):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def count(self, counter: str, value):
+        if self.enabled:
+            self.counts[counter] = value
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        total = time.perf_counter() - self.frame_start
+        allocated = ASSETS.surfaces_created + TEXT.misses
+        self.counts["surfaces_allocated"] = allocated - self.allocated
+        self.allocated = allocated
+        self.history.append((total, self.phases, self.counts))
+        if self.trace is not None:
+            self.write_trace(total)
+        self.frame += 1
+
+    def percentile(self, fraction: float):
+        """
+        Frame time in seconds that the given fraction of the kept frames came in under
+        """
+        if not self.history:
+            return 0.0
+        times = sorted(total for total, phases, counts in self.history)
+        return times[min(len(times) - 1, int(fraction * len(times)))]
+
+    def start_trace(self, path: str):
+        """
+        Streams every frame to path from now on, as JSON lines if it ends in .json and as CSV rows of frame,kind,name,value otherwise
+        """
+        self.stop_trace()
+        self.trace = open(path, "w", newline = "")
+        self.trace_json = path.endswith(".json")
+        if not self.trace_json:
+            self.trace.write("frame,kind,name,value\n")
+        if not self.enabled:
+            self.enable()
+
+    def write_trace(self, total):
+        if self.trace_json:
+            self.trace.write(json.dumps({"frame": self.frame, "ms": total * 1000, "phases": {phase: seconds * 1000 for phase, seconds in self.phases.items()},
+                                         "counts": self.counts}) + "\n")
+        else:
+            rows = ["%d,frame,total,%.4f" % (self.frame, total * 1000)]
+            rows += ["%d,phase,%s,%.4f" % (self.frame, phase, seconds * 1000) for phase, seconds in self.phases.items()]
+            rows += ["%d,count,%s,%s" % (self.frame, counter, value) for counter, value in self.counts.items()]
+            self.trace.write("\n".join(rows) + "\n")
+
+    def stop_trace(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+PROFILER = Profiler()
+
+ALLY = "ally"
+ENEMY = "enemy"
+
+AVOID_RADIUS = 15 # Lower number for more dense crowds
+GRID_CELL_SIZE = 32 # Roughly the size of the largest sprite
+USE_SPATIAL_GRID = True # Set to False to use the brute force reference path
+RETARGET_TICKS = 10 # How long enemies chase the same ally before looking for a closer one
+PROJECTILE_POOL_SIZE = 512 # Most retired projectiles of each type kept around for reuse
+BATCH_PROJECTILE_HITS = True # Set to False to test projectiles one at a time, the reference path
+DIRTY_RECTS = True # Set to False to repaint and flip the whole screen every frame
+SHADOW_COLOR = (45, 45, 45)
+SHADOW_HEIGHT = 5 # Shadows are as wide as the frame they are under
+DIFFICULTY_RAMP = .1 # Difficulty gained per enemy killed, increase to change how fast difficulty ramps up
+SPEEDS = (1, 2, 4, 8) # Game speeds Tab cycles through, in ticks per 1/FPS seconds
+MAX_TICKS_PER_FRAME = 16 # Most ticks run between two reads of the input, time owed past that is dropped and the game slows down instead
+MAX_SKIPPED_FRAMES = 3 # Most frames in a row left undrawn while the logic is over the frame budget
+REWIND_TICKS = FPS # How often the rewind buffer takes a snapshot
+REWIND_SNAPSHOTS = 10 # How many snapshots back the rewind buffer reaches
+SNAPSHOT_PATH = "battles.snapshot" # Where F5 saves the battle and F9 loads it from
+
+class EntitySet:
+    """
+    List with O(1) membership tests and O(1) swap-remove
+    Removing moves the last entity into the freed slot, so order is only stable between removals
+    """
+    def __init__(self):
+        self.items = []
+        self.index = {} # entity -> position in items
+
+    def add(self, entity):
+        self.index[entity] = len(self.items)
+        self.items.append(entity)
+
+    def extend(self, entities):
+        """
+        Adds every entity of a list in order
+        """
+        start = len(self.items)
+        self.index.update(zip(entities, range(start, start + len(entities))))
+        self.items.extend(entities)
+
+    def remove(self, entity):
+        i = self.index.pop(entity)
+        last = self.items.pop()
+        if last is not entity:
+            self.items[i] = last
+            self.index[last] = i
+
+    def __contains__(self, entity):
+        return entity in self.index
+
+    def __iter__(self):
+        # Iterating the list itself means entities added mid-loop are still visited
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+class SpatialGrid:
+    """
+    Uniform grid that buckets sprites by position so neighbour queries only look at nearby cells
+    Sprites are moved between cells as they move, so the grid is always in sync with the registry
+    """
+    def __init__(self, cell_size: int = GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {} # (cell x, cell y) -> set of sprites
+        self.sprite_cells = {} # sprite -> (cell x, cell y)
+        self.max_width = 0
+        self.max_height = 0
+
+    def cell_of(self, x, y):
+        # floor() of a true division rather than //, which is several times slower on floats. Every key comes from here
+        # or extend(), so it only matters that both agree
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def insert(self, sprite):
+        key = self.cell_of(sprite.x, sprite.y)
+        self.cells.setdefault(key, set()).add(sprite)
+        self.sprite_cells[sprite] = key
+        self.max_width = max(self.max_width, sprite.rect.width)
+        self.max_height = max(self.max_height, sprite.rect.height)
+
+    def extend(self, sprites):
+        """
+        insert() for every sprite of a list, in one pass
+        """
+        cell_size = self.cell_size
+        cells = self.cells
+        floor = math.floor
+        keys = [(floor(sprite.x / cell_size), floor(sprite.y / cell_size)) for sprite in sprites]
+        self.sprite_cells.update(zip(sprites, keys))
+        for key, sprite in zip(keys, sprites):
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = {sprite}
+            else:
+                cell.add(sprite)
+        if sprites:
+            self.max_width = max(self.max_width, max([sprite.rect.width for sprite in sprites]))
+            self.max_height = max(self.max_height, max([sprite.rect.height for sprite in sprites]))
+
+    def remove(self, sprite):
+        key = self.sprite_cells.pop(sprite, None)
+        if key is not None:
+            self.cells[key].discard(sprite)
+
+    def move(self, sprite):
+        old_key = self.sprite_cells.get(sprite)
+        if old_key is None:
+            return
+        key = self.cell_of(sprite.x, sprite.y)
+        if key != old_key:
+            self.cells[old_key].discard(sprite)
+            self.cells.setdefault(key, set()).add(sprite)
+            self.sprite_cells[sprite] = key
+
+    def query(self, left, top, right, bottom, members):
+        """
+        Returns the living sprites of an EntitySet whose position lies in the cells covering the box
+        """
+        x0, y0 = self.cell_of(left, top)
+        x1, y1 = self.cell_of(right, bottom)
+        found = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    for sprite in cell:
+                        if sprite.alive and sprite in members:
+                            found.append(sprite)
+        found.sort(key = members.index.get) # Same order as iterating members so results match the brute force path
+        return found
+
+    def query_radius(self, x, y, radius, members):
+        return self.query(x - radius, y - radius, x + radius, y + radius, members)
+
+    def query_rect(self, rect, members):
+        # Sprites are bucketed by their top left corner, so pad by the largest sprite to catch overlapping rects
+        return self.query(rect.left - self.max_width - 1, rect.top - self.max_height - 1, rect.right + 1, rect.bottom + 1, members)
+
+class NearestIndex:
+    """
+    Snapshot of sprite positions bucketed into a grid, answers closest sprite queries by searching outward ring by ring
+    Built once per tick. Ties go to the sprite that comes first in the snapshot, the same as min() over a list
+    """
+    def __init__(self, sprites, cell_size: int = None):
+        self.sprites = list(sprites)
+        if cell_size is None:
+            cell_size = max(16, int(max(WIDTH, HEIGHT) / math.sqrt(len(self.sprites) or 1))) # About one sprite per cell
+        self.cell_size = cell_size
+        self.positions = [(order, sprite.x, sprite.y) for order, sprite in enumerate(self.sprites)]
+        self.cells = {} # (cell x, cell y) -> [(snapshot order, x, y)]
+        for position in self.positions:
+            self.cells.setdefault(self.cell_of(position[1], position[2]), []).append(position)
+        if self.cells:
+            self.min_x = min(key[0] for key in self.cells)
+            self.max_x = max(key[0] for key in self.cells)
+            self.min_y = min(key[1] for key in self.cells)
+            self.max_y = max(key[1] for key in self.cells)
+
+    def cell_of(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def ring(self, cx, cy, radius):
+        """
+        Yields the cells exactly radius cells away from (cx, cy) that lie inside the occupied area
+        """
+        if radius == 0:
+            yield (cx, cy)
+            return
+        left = max(cx - radius, self.min_x)
+        right = min(cx + radius, self.max_x)
+        for y in (cy - radius, cy + radius):
+            if self.min_y <= y <= self.max_y:
+                for x in range(left, right + 1):
+                    yield (x, y)
+        bottom = max(cy - radius + 1, self.min_y)
+        top = min(cy + radius - 1, self.max_y)
+        for x in (cx - radius, cx + radius):
+            if self.min_x <= x <= self.max_x:
+                for y in range(bottom, top + 1):
+                    yield (x, y)
+
+    def nearest(self, x, y):
+        """
+        Returns the sprite closest to (x, y), or None if the index is empty
+        Falls back to checking every sprite once the rings have cost more than that would, e.g. far from a tight cluster
+        """
+        if not self.cells:
+            return None
+        cx, cy = self.cell_of(x, y)
+        # Rings that do not reach the occupied area are empty, and so are rings past its furthest cell
+        radius = max(self.min_x - cx, cx - self.max_x, self.min_y - cy, cy - self.max_y, 0)
+        furthest = max(cx - self.min_x, self.max_x - cx, cy - self.min_y, self.max_y - cy)
+        cells = self.cells
+        budget = len(self.positions)
+        best_order = -1
+        best_distance = math.inf # Squared
+        while True:
+            for key in self.ring(cx, cy, radius):
+                budget -= 1
+                cell = cells.get(key)
+                if cell:
+                    budget -= len(cell)
+                    # A cell lists its sprites in snapshot order, so the first closest one in it wins its ties
+                    cell_order = -1
+                    cell_distance = math.inf
+                    for order, sprite_x, sprite_y in cell:
+                        dx = x - sprite_x
+                        dy = y - sprite_y
+                        distance = dx * dx + dy * dy
+                        if distance < cell_distance:
+                            cell_order = order
+                            cell_distance = distance
+                    if cell_distance < best_distance or (cell_distance == best_distance and cell_order < best_order):
+                        best_order = cell_order
+                        best_distance = cell_distance
+            # Every cell further out is at least radius cells away
+            reach = radius * self.cell_size
+            if best_distance < reach * reach or radius >= furthest:
+                return self.sprites[best_order]
+            if budget < 0:
+                return self.nearest_scan(x, y)
+            radius += 1
+
+    def nearest_scan(self, x, y):
+        """
+        nearest() by checking every sprite
+        """
+        best_order = -1
+        best_distance = math.inf
+        for order, sprite_x, sprite_y in self.positions:
+            dx = x - sprite_x
+            dy = y - sprite_y
+            distance = dx * dx + dy * dy
+            if distance < best_distance:
+                best_order = order
+                best_distance = distance
+        return self.sprites[best_order]
+
+    def nearest_many(self, positions):
+        return [self.nearest(x, y) for x, y in positions]
+
+class ProjectilePool:
+    """
+    Recycles retired projectiles instead of allocating new ones, with a free list per projectile type
+    Each free list holds at most capacity projectiles, anything past that is left to the garbage collector
+    """
+    def __init__(self, capacity: int = PROJECTILE_POOL_SIZE):
+        self.capacity = capacity
+        self.free = {} # type -> retired projectiles
+        self.live = {} # type -> projectiles in play
+        self.high_water = {} # type -> most projectiles in play at once
+        self.created = {} # type -> projectiles ever allocated
+
+    def acquire(self, projectile_type, x, y, speed, dirr, atk):
+        free = self.free.setdefault(projectile_type, [])
+        if free:
+            projectile = free.pop()
+            projectile.reset(x, y, speed, dirr, atk)
+        else:
+            projectile = projectile_type(x, y, speed, dirr, atk)
+            self.created[projectile_type] = self.created.get(projectile_type, 0) + 1
+        live = self.live.get(projectile_type, 0) + 1
+        self.live[projectile_type] = live
+        self.high_water[projectile_type] = max(self.high_water.get(projectile_type, 0), live)
+        return projectile
+
+    def adopt(self, projectile):
+        """
+        Counts a projectile put in play without acquire(), like one restored from a snapshot, so releasing it balances out
+        """
+        projectile_type = type(projectile)
+        self.created[projectile_type] = self.created.get(projectile_type, 0) + 1
+        live = self.live.get(projectile_type, 0) + 1
+        self.live[projectile_type] = live
+        self.high_water[projectile_type] = max(self.high_water.get(projectile_type, 0), live)
+
+    def release(self, projectile):
+        projectile_type = type(projectile)
+        if projectile_type not in self.live: # Spawned directly instead of through acquire()
+            return
+        self.live[projectile_type] += -1
+        free = self.free.setdefault(projectile_type, [])
+        if len(free) < self.capacity:
+            free.append(projectile)
+
+    def report(self):
+        """
+        Returns {type name: {"live", "free", "created", "high_water"}}
+        """
+        return {projectile_type.__name__: {"live": self.live.get(projectile_type, 0),
+                                           "free": len(self.free.get(projectile_type, ())),
+                                           "created": self.created.get(projectile_type, 0),
+                                           "high_water": self.high_water.get(projectile_type, 0)}
+                for projectile_type in self.created}
+
+def in_place(saved, field):
+    """
+    Returns the entities of (..., entity) tuples, each one at the position given by its field,
+    which has to run over every position exactly once
+    """
+    entities = [None] * len(saved)
+    for fields in saved:
+        entities[fields[field]] = fields[-1]
+    return entities
+
+class Registry:
+    """
+    Owns every entity in play, split by faction, with projectiles kept apart from units
+    Deaths are queued with kill() and only removed by flush() at the end of the tick,
+    so nothing is skipped or shuffled while the tick is iterating
+    """
+    def __init__(self, engine = None, pool: ProjectilePool = None):
+        self.all = EntitySet()
+        self.factions = {ALLY: EntitySet(), ENEMY: EntitySet()}
+        self.projectiles = EntitySet()
+        self.grid = SpatialGrid() if engine is None else None # The numpy engine does its own neighbour search
+        self.engine = engine
+        self.pool = pool
+        self.dead = []
+
+    def add(self, entity):
+        self.all.add(entity)
+        if isinstance(entity, Projectile):
+            self.projectiles.add(entity)
+            if self.engine is not None:
+                self.engine.add_projectile(entity)
+        else:
+            self.factions[entity.faction].add(entity)
+            if self.grid is not None:
+                self.grid.insert(entity)
+            if self.engine is not None:
+                self.engine.add(entity)
+
+    def kill(self, entity):
+        if entity.alive:
+            entity.alive = False
+            self.dead.append(entity)
+
+    def flush(self):
+        for entity in self.dead:
+            self.all.remove(entity)
+            if isinstance(entity, Projectile):
+                self.projectiles.remove(entity)
+                if self.engine is not None:
+                    self.engine.remove_projectile(entity)
+                if self.pool is not None:
+                    self.pool.release(entity)
+            else:
+                self.factions[entity.faction].remove(entity)
+                if self.grid is not None:
+                    self.grid.remove(entity)
+                if self.engine is not None:
+                    self.engine.remove(entity)
+        self.dead.clear()
+
+    def restore(self, entities, orders, slots):
+        """
+        Adds the entities of a snapshot in update order, putting every faction and projectile set
+        and every numpy engine slot back in the order it was saved in
+        orders and slots are lists giving each entity's saved position in its set and its engine slot
+        """
+        self.all.extend(entities)
+        saved = {ALLY: [], ENEMY: [], None: []} # faction or None for projectiles -> (order, slot, entity)
+        for entity, order, slot in zip(entities, orders, slots):
+            saved[None if isinstance(entity, Projectile) else entity.faction].append((order, slot, entity))
+        for faction, members in self.factions.items():
+            members.extend(in_place(saved[faction], 0))
+        self.projectiles.extend(in_place(saved[None], 0))
+        units = saved[ALLY] + saved[ENEMY]
+        if self.grid is not None:
+            self.grid.extend([unit for _, _, unit in units])
+        if self.engine is not None:
+            self.engine.extend(in_place(units, 1))
+            self.engine.extend_projectiles(in_place(saved[None], 1))
+
+    def opponents(self, faction):
+        return self.factions[ENEMY if faction == ALLY else ALLY]
+
+VECTOR_EPSILON = 1e-6 # Shortest vector pygame.math.Vector2 will scale
+
+def heading(angle):
+    """
+    Unit vector pointing at angle radians, the same floats as pygame.math.Vector2(1, 0).rotate_rad(angle)
+    """
+    angle = math.fmod(angle, 2 * math.pi)
+    if angle < 0:
+        angle += 2 * math.pi
+    # Vector2 snaps quarter turns to exact axes
+    if math.fmod(angle + VECTOR_EPSILON, math.pi/2) < 2 * VECTOR_EPSILON:
+        return ((1.0, 0.0), (-0.0, 1.0), (-1.0, -0.0), (0.0, -1.0), (1.0, 0.0))[int((angle + VECTOR_EPSILON) / (math.pi/2))]
+    return math.cos(angle), math.sin(angle)
+
+def scale_to(x, y, length):
+    """
+    (x, y) scaled to length like Vector2.scale_to_length, vectors too short to have a direction are left as they are
+    """
+    old_length = math.sqrt(x * x + y * y)
+    if old_length < VECTOR_EPSILON:
+        return x, y
+    fraction = length / old_length
+    return x * fraction, y * fraction
+
+class Sprite:
+    """
+    Base of every unit, slotted and holding plain floats so a crowd of thousands stays small
+    Subclasses have to declare __slots__ too, or every instance gets a __dict__ again
+    """
+    __slots__ = ("world", "x", "y", "vel_x", "vel_y", "speed", "hp", "atk", "image", "rect", "dir", "alive",
+                 "target_x", "target_y", "slot", "taking_damage", "idle_anim_index", "run_anim_index", "idle_anims", "run_anims")
+    faction = None
+    melee = True # False for units whose attack() is a ranged attack or a summon
+    attack_ticks = 0 # For those, the mean number of ticks between attack() calls, timed by World.schedule_attack()
+
+    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = None):
+        self.world = None # Set when spawned into a World
+        self.x = x
+        self.y = y
         self.speed = speed
         self.hp = hp * FPS # 1 HP = 1 second of survival when attacked at 1 atk
         self.atk = atk
-        self.image = image
-        self.rect = self.image.get_rect()
-        self.vel = pygame.math.Vector2(0, 0)
-        self.acc = pygame.math.Vector2(0, 0)
+        self.image = image if image is not None else ASSETS.image("crate.png")
+        self.rect = self.image.get_rect(topleft = (x, y))
+        self.vel_x = 0.0
+        self.vel_y = 0.0
         self.dir = 0.0 # radians
-        self.target_x = self.pos.x
-        self.target_y = self.pos.y
+        self.alive = True
+        self.target_x = x
+        self.target_y = y
+        self.slot = None # Index into the numpy engine's arrays when it is in use
 
         self.taking_damage = False
 
         self.idle_anim_index = 0
         self.run_anim_index = 0
-        self.idle_anims = []
-        self.run_anims = []
+        self.idle_anims = () # Shared per type, from ASSETS.frames()
+        self.run_anims = ()
 
     def update(self):
         """
-        Behavior function meant to be overridden
+        Behavior function meant to be overridden, advances the sprite by one tick
         """
         pass
 
+    def place(self, x, y):
+        """
+        Teleports the sprite and makes it hold there, only meant to be used before it is spawned
+        """
+        self.x = x
+        self.y = y
+        self.rect.topleft = (x, y)
+        self.target_x = x
+        self.target_y = y
+
     def move(self, x, y):
         x += -self.image.get_width()//2
         y += -self.image.get_height()//2
 
-        dy = y - self.pos.y
-        dx = x - self.pos.x
+        dy = y - self.y
+        dx = x - self.x
 
         # Prevent divide by 0 error
         if dx != 0:
@@ -77,518 +832,1280 @@ class Sprite(pygame.sprite.Sprite):
             self.dir = ((dy > 0) * math.pi/2) + ((dy < 0) * 3*math.pi/2)
 
         if abs(dx) > self.speed and abs(dy) > self.speed:
-            self.acc = pygame.math.Vector2(1, 0).rotate_rad(self.dir)
-            self.social_distance()
-            try:
-                self.acc.scale_to_length(self.speed)
-            except:
-                pass
-            self.acc += -self.vel
-            self.vel += self.acc
-            self.pos += self.vel
+            acc_x, acc_y = heading(self.dir)
+            acc_x, acc_y = self.social_distance(acc_x, acc_y)
+            acc_x, acc_y = scale_to(acc_x, acc_y, self.speed)
+            acc_x += -self.vel_x
+            acc_y += -self.vel_y
+            self.vel_x += acc_x
+            self.vel_y += acc_y
+            self.x += self.vel_x
+            self.y += self.vel_y
         else:
-            try:
-                self.vel.scale_to_length(0)
-                self.acc.scale_to_length(0)
-            except:
-                pass
+            self.vel_x, self.vel_y = scale_to(self.vel_x, self.vel_y, 0)
 
-        self.rect.update(self.pos.x, self.pos.y, self.rect.width, self.rect.height)
+        self.rect.update(self.x, self.y, self.rect.width, self.rect.height)
+        self.world.registry.grid.move(self)
 
-    def draw(self):
+    def animate(self):
         """
-        Handles animation and which direction sprite is facing
+        Advances the idle or run animation by one tick
         """
-        def idle_animations():
-            SLOWDOWN_FACTOR = 6 # How much to slow the animation down by
+        SLOWDOWN_FACTOR = 6 # How much to slow the animation down by
 
+        if self.vel_x * self.vel_x + self.vel_y * self.vel_y == 0:
             self.image = self.idle_anims[self.idle_anim_index // SLOWDOWN_FACTOR]
             self.idle_anim_index += 1
             if self.idle_anim_index >= len(self.idle_anims) * SLOWDOWN_FACTOR:
                     self.idle_anim_index = 0
-
-        def run_animations():
-            SLOWDOWN_FACTOR = 6 # How much to slow the animation down by
-
+        else:
             self.image = self.run_anims[self.run_anim_index // SLOWDOWN_FACTOR]
             self.run_anim_index += 1
             if self.run_anim_index >= len(self.run_anims) * SLOWDOWN_FACTOR:
                     self.run_anim_index = 0
 
-        def damage_animations():
-            image_copy = self.image.copy()
-            image_copy.fill((255, 0, 0), special_flags = pygame.BLEND_MULT)
-            self.image = image_copy
-            WINDOW.blit(image_copy, (self.pos.x, self.pos.y))
-            self.taking_damage = False
+    def snapshot_row(self, registry: "Registry"):
+        """
+        Returns the snapshot.ENTITY fields of this unit
+        """
+        frame = ASSETS.frame_numbers(self.idle_anims, self.run_anims).get(self.image, -1)
+        target, retarget_tick = self.target_row(registry)
+        return (ENTITY_TYPE_IDS[type(self)], snapshot.TAKING_DAMAGE if self.taking_damage else 0,
+                registry.factions[self.faction].index[self], -1 if self.slot is None else self.slot,
+                self.x, self.y, self.vel_x, self.vel_y, self.dir, self.speed, self.hp, self.atk, self.target_x, self.target_y,
+                target, retarget_tick, self.idle_anim_index, self.run_anim_index, frame, self.rect.x, self.rect.y)
+
+    def target_row(self, registry: "Registry"):
+        """
+        Returns (snapshot position of the unit being chased or -1, tick to look for a closer one)
+        """
+        return -1, 0
 
-        if self.vel.magnitude() == 0:
-            idle_animations()
+    def restore_row(self, row, template: "Sprite"):
+        """
+        Fills in a blank instance, made without calling the constructor, from the state saved by snapshot_row()
+        and the animations and rect size of template, a unit of the same type built at (0, 0) by the same World.
+        The world and target are left for the caller, the target needs every entity restored first
+        """
+        (_, flags, _, _, self.x, self.y, self.vel_x, self.vel_y, self.dir, self.speed, self.hp, self.atk,
+         self.target_x, self.target_y, _, _, self.idle_anim_index, self.run_anim_index, frame, left, top) = row
+        self.slot = None
+        self.alive = True
+        self.taking_damage = flags & snapshot.TAKING_DAMAGE != 0
+        self.rect = template.rect.move(left, top)
+        idle_anims = self.idle_anims = template.idle_anims
+        run_anims = self.run_anims = template.run_anims
+        if frame < 0:
+            self.image = template.image
+        elif frame < len(idle_anims):
+            self.image = idle_anims[frame]
         else:
-            run_animations()
-        if self.taking_damage:
-            damage_animations()
+            self.image = run_anims[frame - len(idle_anims)]
 
+    def submit(self, queue: "RenderQueue"):
+        """
+        Queues the shadow and the frame, handling which direction sprite is facing and the damage tint
+        """
+        image = self.image
+        bottom = self.y + image.get_height()
+        queue.floor.append((ASSETS.shadows[image], (self.x, bottom)))
+
+        variant = NORMAL
         # Facing left or right
-        if self.dir < math.pi/2 and self.dir > -math.pi/2:
-            WINDOW.blit(self.image, (self.pos.x, self.pos.y))
-        else:
-            WINDOW.blit(pygame.transform.flip(self.image, True, False), (self.pos.x, self.pos.y))
+        if not (self.dir < math.pi/2 and self.dir > -math.pi/2):
+            variant |= FLIPPED
+        if self.taking_damage:
+            variant |= TINTED
+            self.taking_damage = False
+        queue.sprites.append((bottom, ASSETS.variants[image][variant], (self.x, self.y)))
 
-    def social_distance(self):
+    def social_distance(self, acc_x, acc_y):
         """
-        Prevent sprites from bunching up
+        Prevent sprites from bunching up. Returns the acceleration pushed away from close neighbours
         """
-        AVOID_RADIUS = 15 # Lower number for more dense crowds
+        if self.faction is None:
+            return acc_x, acc_y
+        registry = self.world.registry
+        allies = registry.factions[self.faction]
+        if self.world.use_grid:
+            nearby = registry.grid.query_radius(self.x, self.y, AVOID_RADIUS, allies)
+        else:
+            nearby = [sprite for sprite in allies if sprite.alive]
 
-        for sprite in all_sprites:
+        for sprite in nearby:
             if sprite != self:
-                if (self in ally_sprites and sprite in ally_sprites) or (self in enemy_sprites and sprite in enemy_sprites):
-                    dist = self.pos - sprite.pos
-                    if 0 < dist.length() < AVOID_RADIUS:
-                        self.acc += dist.normalize()
+                dist_x = self.x - sprite.x
+                dist_y = self.y - sprite.y
+                dist = math.sqrt(dist_x * dist_x + dist_y * dist_y)
+                if 0 < dist < AVOID_RADIUS:
+                    acc_x += dist_x / dist
+                    acc_y += dist_y / dist
+        return acc_x, acc_y
 
     def attack(self):
-        for sprite in all_sprites:
-            if (self in ally_sprites and sprite in enemy_sprites) or (self in enemy_sprites and sprite in ally_sprites):
-                if pygame.sprite.collide_rect(self, sprite):
-                    sprite.taking_damage = True
-                    sprite.hp += -self.atk
+        if self.faction is None:
+            return
+        registry = self.world.registry
+        opponents = registry.opponents(self.faction)
+        if self.world.use_grid:
+            nearby = registry.grid.query_rect(self.rect, opponents)
+        else:
+            nearby = [sprite for sprite in opponents if sprite.alive]
+
+        for sprite in nearby:
+            if pygame.sprite.collide_rect(self, sprite):
+                sprite.taking_damage = True
+                sprite.hp += -self.atk
+
 class Ally(Sprite):
-    def __init__(self, x: int, y: int, speed: float = 2.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = PLACEHOLDER):
+    __slots__ = ()
+    faction = ALLY
+    cost = 0 # Coins needed to summon one
+
+    def __init__(self, x: int, y: int, speed: float = 2.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = None):
         super().__init__(x, y, speed, hp, atk, image)
 
     def update(self):
         if self.hp <= 0:
-            all_sprites.remove(self)
-            ally_sprites.remove(self)
-        self.move(self.target_x, self.target_y)
-        self.attack()
-        self.draw()
+            self.world.registry.kill(self)
+            return
+        if self.world.engine is None: # Otherwise the engine already moved and attacked for everyone
+            self.move(self.target_x, self.target_y)
+            self.attack()
+        self.animate()
 class Enemy(Sprite):
-    def __init__(self, x: int, y: int, speed: float = 2.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = PLACEHOLDER):
+    __slots__ = ("target", "retarget_tick")
+    faction = ENEMY
+
+    def __init__(self, x: int, y: int, speed: float = 2.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = None):
         super().__init__(x, y, speed, hp, atk, image)
+        self.target = None # Ally being chased, picked by World.retarget()
+        self.retarget_tick = 0 # Tick to look for a closer ally again
 
     def update(self):
-        global coins
-        global difficulty
-
-        if ally_sprites:
-            self.target_x, self.target_y = self.find_ally()
-
         if self.hp <= 0:
-            all_sprites.remove(self)
-            enemy_sprites.remove(self)
-            coins += 1
-            difficulty += .1 # Increase to change how fast difficulty ramps up
-        self.move(self.target_x, self.target_y)
-        self.attack()
-        self.draw()
+            self.world.registry.kill(self)
+            self.world.coins += 1
+            self.world.difficulty += self.world.difficulty_ramp
+            return
+
+        if self.world.engine is None: # Otherwise the engine already moved and did melee for everyone
+            if self.target is not None:
+                self.target_x = self.target.x
+                self.target_y = self.target.y
+            self.move(self.target_x, self.target_y)
+            if self.melee:
+                self.attack()
+        self.animate()
+
+    def target_row(self, registry: "Registry"):
+        target = registry.all.index.get(self.target, -1) if self.target is not None else -1
+        return target, self.retarget_tick
+
+    def restore_row(self, row, template: "Enemy"):
+        super().restore_row(row, template)
+        self.target = None
+        self.retarget_tick = row[15]
+
+    def needs_target(self):
+        return self.target is None or not self.target.alive or self.world.tick >= self.retarget_tick
 
     def find_ally(self):
-        distances = []
-        for ally in ally_sprites:
-            distances.append((ally.pos, self.pos.distance_to(ally.pos)))
-        return (min(distances, key = lambda x: x[1])[0])
+        """
+        Returns the closest living ally, or None if there are none
+        Brute force reference for NearestIndex
+        """
+        best = None
+        best_distance = None # Squared
+        for ally in self.world.registry.factions[ALLY]:
+            if ally.alive:
+                dx = self.x - ally.x
+                dy = self.y - ally.y
+                distance = dx * dx + dy * dy
+                if best is None or distance < best_distance:
+                    best = ally
+                    best_distance = distance
+        return best
 
 class Imp(Ally):
-    def __init__(self, x: int, y: int, speed: float = 2.0, hp: float = 2.0, atk: float = 1.0, image: pygame.Surface = IMP):
-        super().__init__(x, y, speed, hp, atk, image)
+    __slots__ = ()
+    cost = 1
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "imp_idle_anim_f0.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "imp_idle_anim_f1.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "imp_idle_anim_f2.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "imp_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "imp_run_anim_f0.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "imp_run_anim_f1.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "imp_run_anim_f2.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "imp_run_anim_f3.png")).convert_alpha()]
+    def __init__(self, x: int, y: int, speed: float = 2.0, hp: float = 2.0, atk: float = 1.0, image: pygame.Surface = None):
+        super().__init__(x, y, speed, hp, atk, image or ASSETS.frames("imp", "idle")[0])
+
+        self.idle_anims = ASSETS.frames("imp", "idle")
+        self.run_anims = ASSETS.frames("imp", "run")
 class Wogol(Ally):
-    def __init__(self, x: int, y: int, speed: float = 4.0, hp: float = 4.0, atk: float = 1.0, image: pygame.Surface = WOGOL):
-        super().__init__(x, y, speed, hp, atk, image)
+    __slots__ = ()
+    cost = 3
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "wogol_idle_anim_f0.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "wogol_idle_anim_f1.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "wogol_idle_anim_f2.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "wogol_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "wogol_run_anim_f0.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "wogol_run_anim_f1.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "wogol_run_anim_f2.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "wogol_run_anim_f3.png")).convert_alpha()]
+    def __init__(self, x: int, y: int, speed: float = 4.0, hp: float = 4.0, atk: float = 1.0, image: pygame.Surface = None):
+        super().__init__(x, y, speed, hp, atk, image or ASSETS.frames("wogol", "idle")[0])
+
+        self.idle_anims = ASSETS.frames("wogol", "idle")
+        self.run_anims = ASSETS.frames("wogol", "run")
 class Chort(Ally):
-    def __init__(self, x: int, y: int, speed: float = 3.0, hp: float = 6.0, atk: float = 2.0, image: pygame.Surface = CHORT):
-        super().__init__(x, y, speed, hp, atk, image)
+    __slots__ = ()
+    cost = 5
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "chort_idle_anim_f0.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "chort_idle_anim_f1.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "chort_idle_anim_f2.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "chort_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "chort_run_anim_f0.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "chort_run_anim_f1.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "chort_run_anim_f2.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "chort_run_anim_f3.png")).convert_alpha()]
+    def __init__(self, x: int, y: int, speed: float = 3.0, hp: float = 6.0, atk: float = 2.0, image: pygame.Surface = None):
+        super().__init__(x, y, speed, hp, atk, image or ASSETS.frames("chort", "idle")[0])
+
+        self.idle_anims = ASSETS.frames("chort", "idle")
+        self.run_anims = ASSETS.frames("chort", "run")
 class Big_Demon(Ally):
-    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 10.0, atk: float = 3.0, image: pygame.Surface = BIG_DEMON):
-        super().__init__(x, y, speed, hp, atk, image)
+    __slots__ = ()
+    cost = 9
+
+    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 10.0, atk: float = 3.0, image: pygame.Surface = None):
+        super().__init__(x, y, speed, hp, atk, image or ASSETS.frames("big_demon", "idle")[0])
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "big_demon_idle_anim_f0.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "big_demon_idle_anim_f1.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "big_demon_idle_anim_f2.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "big_demon_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "big_demon_run_anim_f0.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "big_demon_run_anim_f1.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "big_demon_run_anim_f2.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "big_demon_run_anim_f3.png")).convert_alpha()]
+        self.idle_anims = ASSETS.frames("big_demon", "idle")
+        self.run_anims = ASSETS.frames("big_demon", "run")
 class Elf(Enemy):
-    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = PLACEHOLDER):
+    __slots__ = ()
+    melee = False
+    attack_ticks = 2 * FPS
+
+    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = None):
         super().__init__(x, y, speed, hp, atk, image)
         self.idle_anim_index = 0
         self.run_anim_index = 0
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "elf_m_idle_anim_f0.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "elf_m_idle_anim_f1.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "elf_m_idle_anim_f2.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "elf_m_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "elf_m_run_anim_f0.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "elf_m_run_anim_f1.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "elf_m_run_anim_f2.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "elf_m_run_anim_f3.png")).convert_alpha()]
+        self.idle_anims = ASSETS.frames("elf_m", "idle")
+        self.run_anims = ASSETS.frames("elf_m", "run")
 
     def attack(self):
-        prob = random.randint(1, 2 * FPS)
-        if prob == 1:
-            all_sprites.append(Arrow(self.pos.x, self.pos.y, 3.0, self.dir, 1.0))
+        self.world.fire(Arrow, self.x, self.y, 3.0, self.dir, 1.0)
 class Knight(Enemy):
-    def __init__(self, x: int, y: int, speed: float = 1.5, hp: float = 2.0, atk: float = 1.0, image: pygame.Surface = PLACEHOLDER):
+    __slots__ = ()
+
+    def __init__(self, x: int, y: int, speed: float = 1.5, hp: float = 2.0, atk: float = 1.0, image: pygame.Surface = None):
         super().__init__(x, y, speed, hp, atk, image)
         self.idle_anim_index = 0
         self.run_anim_index = 0
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "knight_m_idle_anim_f0.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "knight_m_idle_anim_f1.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "knight_m_idle_anim_f2.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "knight_m_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "knight_m_run_anim_f0.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "knight_m_run_anim_f1.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "knight_m_run_anim_f2.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "knight_m_run_anim_f3.png")).convert_alpha()]
+        self.idle_anims = ASSETS.frames("knight_m", "idle")
+        self.run_anims = ASSETS.frames("knight_m", "run")
 class Wizard(Enemy):
-    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = PLACEHOLDER):
+    __slots__ = ()
+    melee = False
+    attack_ticks = 4 * FPS
+
+    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = None):
         super().__init__(x, y, speed, hp, atk, image)
         self.idle_anim_index = 0
         self.run_anim_index = 0
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "wizard_m_idle_anim_f0.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "wizard_m_idle_anim_f1.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "wizard_m_idle_anim_f2.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "wizard_m_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "wizard_m_run_anim_f0.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "wizard_m_run_anim_f1.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "wizard_m_run_anim_f2.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "wizard_m_run_anim_f3.png")).convert_alpha()]
+        self.idle_anims = ASSETS.frames("wizard_m", "idle")
+        self.run_anims = ASSETS.frames("wizard_m", "run")
     
     def attack(self):
-        prob = random.randint(1, 4 * FPS)
-        if prob == 1:
-            all_sprites.append(Fireball(self.pos.x, self.pos.y, 3.0, self.dir, 5.0))
+        self.world.fire(Fireball, self.x, self.y, 3.0, self.dir, 5.0)
 class Necromancer(Enemy):
-    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = PLACEHOLDER):
+    __slots__ = ()
+    melee = False
+    attack_ticks = 3 * FPS
+
+    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = None):
         super().__init__(x, y, speed, hp, atk, image)
         self.idle_anim_index = 0
         self.run_anim_index = 0
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "necromancer_idle_anim_f0.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "necromancer_idle_anim_f1.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "necromancer_idle_anim_f2.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "necromancer_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "necromancer_run_anim_f0.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "necromancer_run_anim_f1.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "necromancer_run_anim_f2.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "necromancer_run_anim_f3.png")).convert_alpha()]
+        self.idle_anims = ASSETS.frames("necromancer", "idle")
+        self.run_anims = ASSETS.frames("necromancer", "run")
 
     def attack(self):
         """
         Summon skeletons
         """
-        prob = random.randint(1, 3 * FPS)
-        if prob == 1:
-            random_nearby_x = random.randint(int(self.pos.x) - 5, int(self.pos.x) + 5)
-            random_nearby_y = random.randint(int(self.pos.y) - 5, int(self.pos.y) + 5)
-            skeleton = Skeleton(random_nearby_x, random_nearby_y)
-            enemy_sprites.append(skeleton)
-            all_sprites.append(skeleton)
+        rng = self.world.rng
+        random_nearby_x = rng.randint(int(self.x) - 5, int(self.x) + 5)
+        random_nearby_y = rng.randint(int(self.y) - 5, int(self.y) + 5)
+        skeleton = self.world.create(Skeleton, random_nearby_x, random_nearby_y)
+        skeleton.target = self.target # Summons go straight for their master's target
+        skeleton.retarget_tick = self.retarget_tick
+        self.world.spawn(skeleton)
 class Skeleton(Enemy):
-    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = PLACEHOLDER):
+    __slots__ = ()
+
+    def __init__(self, x: int, y: int, speed: float = 1.0, hp: float = 1.0, atk: float = 1.0, image: pygame.Surface = None):
         super().__init__(x, y, speed, hp, atk, image)
         self.idle_anim_index = 0
         self.run_anim_index = 0
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "skeleton_idle_anim_f0.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "skeleton_idle_anim_f1.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "skeleton_idle_anim_f2.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "skeleton_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "skeleton_run_anim_f0.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "skeleton_run_anim_f1.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "skeleton_run_anim_f2.png")).convert_alpha(),
-                          pygame.image.load(os.path.join("assets", "skeleton_run_anim_f3.png")).convert_alpha()]
+        self.idle_anims = ASSETS.frames("skeleton", "idle")
+        self.run_anims = ASSETS.frames("skeleton", "run")
 class Elven_Knight(Enemy):
-    def __init__(self, x: int, y: int, speed: float = 2.0, hp: float = 10.0, atk: float = 3.0, image: pygame.Surface = PLACEHOLDER):
+    __slots__ = ()
+
+    def __init__(self, x: int, y: int, speed: float = 2.0, hp: float = 10.0, atk: float = 3.0, image: pygame.Surface = None):
         super().__init__(x, y, speed, hp, atk, image)
         self.idle_anim_index = 0
         self.run_anim_index = 0
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "elven_knight_idle_anim_f0.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "elven_knight_idle_anim_f1.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "elven_knight_idle_anim_f2.png")).convert_alpha(),
-                           pygame.image.load(os.path.join("assets", "elven_knight_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "elven_knight_idle_anim_f1.png")).convert_alpha()]
+        self.idle_anims = ASSETS.frames("elven_knight", "idle")
+        self.run_anims = ASSETS.frames("elven_knight", "idle", first = 1, count = 1)
 class Kingsguard(Enemy):
-    def __init__(self, x: int, y: int, speed: float = 1, hp: float = 20.0, atk: float = 5.0, image: pygame.Surface = PLACEHOLDER):
+    __slots__ = ()
+
+    def __init__(self, x: int, y: int, speed: float = 1, hp: float = 20.0, atk: float = 5.0, image: pygame.Surface = None):
         super().__init__(x, y, speed, hp, atk, image)
         self.idle_anim_index = 0
         self.run_anim_index = 0
 
-        self.idle_anims = [pygame.image.load(os.path.join("assets", "kingsguard_idle_anim_f0.png")).convert_alpha(),
-                            pygame.image.load(os.path.join("assets", "kingsguard_idle_anim_f1.png")).convert_alpha(),
-                            pygame.image.load(os.path.join("assets", "kingsguard_idle_anim_f2.png")).convert_alpha(),
-                            pygame.image.load(os.path.join("assets", "kingsguard_idle_anim_f3.png")).convert_alpha()]
-        self.run_anims = [pygame.image.load(os.path.join("assets", "kingsguard_run_anim_f0.png")).convert_alpha(),
-                            pygame.image.load(os.path.join("assets", "kingsguard_run_anim_f1.png")).convert_alpha(),
-                            pygame.image.load(os.path.join("assets", "kingsguard_run_anim_f2.png")).convert_alpha(),
-                            pygame.image.load(os.path.join("assets", "kingsguard_run_anim_f3.png")).convert_alpha()]
+        self.idle_anims = ASSETS.frames("kingsguard", "idle")
+        self.run_anims = ASSETS.frames("kingsguard", "run")
+
+class Projectile:
+    __slots__ = ("world", "x", "y", "vel_x", "vel_y", "speed", "dir", "atk", "rect", "colliding", "alive", "slot")
+    faction = ENEMY # Only enemies fire projectiles
 
-class Projectile(pygame.sprite.Sprite):
     def __init__(self, x: int, y: int, speed: float = 1.0, dirr: float = 0.0, atk: float = 1.0):
-        pygame.sprite.Sprite.__init__(self)
-        self.pos = pygame.math.Vector2(x, y)
+        self.rect = pygame.Rect(x, y, 6, 6)
+        self.world = None # Set when spawned into a World
+        self.slot = None # Index into the numpy engine's arrays when it is in use
+        self.reset(x, y, speed, dirr, atk)
+
+    def reset(self, x: int, y: int, speed: float = 1.0, dirr: float = 0.0, atk: float = 1.0):
+        """
+        Puts the projectile back in its just-fired state so ProjectilePool can reuse it
+        """
+        self.x = x
+        self.y = y
         self.speed = speed
         self.dir = dirr # radians
-        self.vel = pygame.math.Vector2(0, 0)
-        self.acc = pygame.math.Vector2(0, 0)
+        self.vel_x = 0.0
+        self.vel_y = 0.0
         self.atk = atk
-        self.rect = pygame.Rect(self.pos.x, self.pos.y, 6, 6)
+        self.rect.topleft = (x, y)
         self.colliding = False
+        self.alive = True
+
+    def flying(self):
+        """
+        Whether the projectile moves this tick
+        """
+        return True
 
     def update(self):
         """
-        Behavior function meant to be overridden
+        Behavior function meant to be overridden, advances the projectile by one tick
         """
         pass
 
-    def draw(self):
+    def submit(self, queue: "RenderQueue"):
         """
         Behavior function meant to be overridden
         """
         pass
 
     def move(self):
-        self.acc = pygame.math.Vector2(1, 0).rotate_rad(self.dir)
-        try:
-            self.acc.scale_to_length(self.speed)
-        except:
-            pass
-        self.acc += -self.vel
-        self.vel += self.acc
-        self.pos += self.vel
-        
-        self.rect.update(self.pos.x, self.pos.y, self.rect.width, self.rect.height)
+        acc_x, acc_y = heading(self.dir)
+        acc_x, acc_y = scale_to(acc_x, acc_y, self.speed)
+        acc_x += -self.vel_x
+        acc_y += -self.vel_y
+        self.vel_x += acc_x
+        self.vel_y += acc_y
+        self.x += self.vel_x
+        self.y += self.vel_y
+
+        self.rect.update(self.x, self.y, self.rect.width, self.rect.height)
+
+    def snapshot_row(self, registry: Registry):
+        """
+        Returns the snapshot.ENTITY fields of this projectile
+        """
+        flags, anim_index, frame = self.animation_row()
+        return (ENTITY_TYPE_IDS[type(self)], flags | (snapshot.COLLIDING if self.colliding else 0),
+                registry.projectiles.index[self], -1 if self.slot is None else self.slot,
+                self.x, self.y, self.vel_x, self.vel_y, self.dir, self.speed, 0.0, self.atk, 0.0, 0.0, -1, 0, anim_index, 0, frame,
+                self.rect.x, self.rect.y)
+
+    def animation_row(self):
+        """
+        Returns (extra snapshot flags, animation index, frame shown or -1)
+        """
+        return 0, 0, -1
+
+    def restore_row(self, row, template: "Projectile"):
+        """
+        Fills in a blank instance, made without calling the constructor, from the state saved by snapshot_row()
+        and the rect size of template, a projectile of the same type built at (0, 0)
+        """
+        (_, flags, _, _, self.x, self.y, self.vel_x, self.vel_y, self.dir, self.speed, _, self.atk,
+         _, _, _, _, _, _, _, left, top) = row
+        self.slot = None
+        self.alive = True
+        self.colliding = flags & snapshot.COLLIDING != 0
+        self.rect = template.rect.move(left, top)
+
+    def out_of_bounds(self):
+        return self.x < 0 or self.x > WIDTH or self.y < 0 or self.y > HEIGHT
 
     def attack(self):
+        """
+        Hits every living opponent the projectile overlaps
+        Reference for the batched pass in World.resolve_projectiles()
+        """
         self.colliding = False
 
-        if self.pos.x < 0 or self.pos.x > WIDTH or self.pos.y < 0 or self.pos.y > HEIGHT:
-            all_sprites.remove(self)
+        if self.out_of_bounds():
+            self.world.registry.kill(self)
         else:
-            for sprite in ally_sprites:
-                if pygame.sprite.collide_rect(self, sprite):
+            for sprite in self.world.registry.opponents(self.faction):
+                if sprite.alive and pygame.sprite.collide_rect(self, sprite):
                     self.colliding = True
                     sprite.taking_damage = True
                     sprite.hp += -self.atk
 class Arrow(Projectile):
-    def __init__(self, x: int, y: int, speed: float = 1.0, dirr: float = 0.0, atk: float = 1.0):
-        super().__init__(x, y, speed, dirr, atk)
-        self.color = (192, 192, 192)
+    __slots__ = ()
+    color = (192, 192, 192)
 
     def update(self):
-        if not self.colliding:
+        if self.flying() and self.world.engine is None: # Otherwise the engine already moved it
             self.move()
-        self.attack()
-        self.draw()
 
-    def draw(self):
-        pygame.draw.ellipse(WINDOW, self.color, self.rect)
+    def flying(self):
+        return not self.colliding
+
+    def submit(self, queue: "RenderQueue"):
+        rect = self.rect
+        queue.sprites.append((rect.bottom, ASSETS.ellipse(rect.width, rect.height, self.color), rect.topleft))
 class Fireball(Projectile):
-    def __init__(self, x: int, y: int, speed: float = 1.0, dirr: float = 0.0, atk: float = 1.0, image: pygame.Surface = PLACEHOLDER):
+    __slots__ = ("frames", "anim_index", "image", "exploding")
+
+    def __init__(self, x: int, y: int, speed: float = 1.0, dirr: float = 0.0, atk: float = 1.0):
+        self.frames = ASSETS.sequence("explosion_f", 64, folder = "explosion_frames")
         super().__init__(x, y, speed, dirr, atk)
+        self.rect = self.image.get_rect(topleft = (x, y))
+
+    def reset(self, x: int, y: int, speed: float = 1.0, dirr: float = 0.0, atk: float = 1.0):
+        super().reset(x, y, speed, dirr, atk)
         self.anim_index = 0
-        self.image = pygame.image.load(os.path.join("assets/explosion_frames", "explosion_f0.png")).convert_alpha()
-        self.rect = self.image.get_rect()
+        self.image = self.frames[0]
         self.exploding = False
 
+    def flying(self):
+        return not self.exploding
+
     def update(self):
-        if not self.exploding:
+        # Checked here rather than in animate() so the last frame still gets its hit test this tick
+        if self.anim_index >= len(self.frames):
+            self.world.registry.kill(self)
+            return
+        if self.flying() and self.world.engine is None: # Otherwise the engine already moved it
             self.move()
         if self.colliding:
             self.exploding = True
-        self.attack()
-        self.draw()
-            
-    def draw(self):
-        self.image = pygame.image.load(os.path.join("assets/explosion_frames", "explosion_f" + str(self.anim_index) + ".png")).convert_alpha()
-        WINDOW.blit(self.image, (self.pos.x, self.pos.y))
+        self.animate()
+
+    def animate(self):
+        self.image = self.frames[self.anim_index]
         if self.exploding:
             self.anim_index += 1
-        if self.anim_index > 63:
-            all_sprites.remove(self)
 
-def main():
-    pygame.init()
-    pygame.font.init()
-    clock = pygame.time.Clock()
-    running = True
-    main_font = pygame.font.Font(os.path.join("assets", "Silver.ttf"), 25)
-
-    imp_button = pygame.Rect(10, HEIGHT - 50, 25, 25)
-    wogol_button = pygame.Rect(40, HEIGHT - 50, 25, 25)
-    chort_button = pygame.Rect(70, HEIGHT - 50, 25, 25)
-    big_demon_button = pygame.Rect(100, HEIGHT - 50, 25, 25)
-
-    begin_imps = [Imp(WIDTH//2 - IMP.get_width()//2, HEIGHT//2 - IMP.get_height()//2),
-                  Imp(WIDTH//2 - IMP.get_width()//2 - 10, HEIGHT//2 - IMP.get_height()//2),
-                  Imp(WIDTH//2 - IMP.get_width()//2 + 10, HEIGHT//2 - IMP.get_height()//2),
-                  Imp(WIDTH//2 - IMP.get_width()//2, HEIGHT//2 - IMP.get_height()//2 - 10),
-                  Imp(WIDTH//2 - IMP.get_width()//2, HEIGHT//2 - IMP.get_height()//2 + 10)]
-    for imp in begin_imps:
-        ally_sprites.append(imp)
-        all_sprites.append(imp)
-
-    def draw_ui():
-        # Coins
-        coins_label = main_font.render(str(coins), 1, (255, 255, 255))
-        WINDOW.blit(COIN, (10, 27))
-        WINDOW.blit(coins_label, (25, 24))
-
-        # Sprite Summon Art
-        WINDOW.blit(IMP, (imp_button.x + 4, imp_button.y + 2))
-        WINDOW.blit(WOGOL, (wogol_button.x + 4, wogol_button.y))
-        WINDOW.blit(CHORT, (chort_button.x + 4, chort_button.y - 3))
-        WINDOW.blit(BIG_DEMON, (big_demon_button.x - 4, big_demon_button.y - 9))
-
-        # Sprite Summon Box
-        pygame.draw.rect(WINDOW, (180, 180, 180), imp_button, 1)
-        pygame.draw.rect(WINDOW, (180, 180, 180), wogol_button, 1)
-        pygame.draw.rect(WINDOW, (180, 180, 180), chort_button, 1)
-        pygame.draw.rect(WINDOW, (180, 180, 180), big_demon_button, 1)
-
-        # Sprite Summon Cost
-        WINDOW.blit(COIN, (imp_button.x + 15, imp_button.y + 15))
-        WINDOW.blit(main_font.render("1", 1, (0, 0, 0)), (imp_button.x + 17, imp_button.y + 15))
-        WINDOW.blit(COIN, (wogol_button.x + 15, wogol_button.y + 15))
-        WINDOW.blit(main_font.render("3", 1, (0, 0, 0)), (wogol_button.x + 17, wogol_button.y + 15))
-        WINDOW.blit(COIN, (chort_button.x + 15, chort_button.y + 15))
-        WINDOW.blit(main_font.render("5", 1, (0, 0, 0)), (chort_button.x + 17, chort_button.y + 15))
-        WINDOW.blit(COIN, (big_demon_button.x + 15, big_demon_button.y + 15))
-        WINDOW.blit(main_font.render("9", 1, (0, 0, 0)), (big_demon_button.x + 17, big_demon_button.y + 15))
-
-    def button_event(mouse_pos, spawn):
-        """
-        Performs the behavior of buttons. Returns True if button is pressed
-        """
-        global coins
-        sprite = None
-        center_x = WIDTH//2
-        center_y = HEIGHT//2
-
-        if imp_button.collidepoint(mouse_pos) or spawn == Imp:
-            cost = 1
-            if coins >= cost:
-                coins += -cost
-                sprite = Imp(center_x - IMP.get_width()//2, center_y - IMP.get_height()//2)
-        elif wogol_button.collidepoint(mouse_pos) or spawn == Wogol:
-            cost = 3
-            if coins >= cost:
-                coins += -cost
-                sprite = Wogol(center_x - WOGOL.get_width()//2, center_y - WOGOL.get_height()//2)
-        elif chort_button.collidepoint(mouse_pos) or spawn == Chort:
-            cost = 5
-            if coins >= cost:
-                coins += -cost
-                sprite = Chort(center_x - CHORT.get_width()//2, center_y - CHORT.get_height()//2)
-        elif big_demon_button.collidepoint(mouse_pos) or spawn == Big_Demon:
-            cost = 9
-            if coins >= cost:
-                coins += -cost
-                sprite = Big_Demon(center_x - BIG_DEMON.get_width()//2, center_y - BIG_DEMON.get_height()//2)
+    def animation_row(self):
+        return snapshot.EXPLODING if self.exploding else 0, self.anim_index, ASSETS.frame_numbers(self.frames)[self.image]
+
+    def restore_row(self, row, template: "Fireball"):
+        super().restore_row(row, template)
+        self.frames = template.frames
+        self.exploding = row[1] & snapshot.EXPLODING != 0
+        self.anim_index = row[16]
+        self.image = self.frames[row[18]]
+
+    def submit(self, queue: "RenderQueue"):
+        queue.sprites.append((self.y + self.image.get_height(), self.image, (self.x, self.y)))
+
+SHOP = (Imp, Wogol, Chort, Big_Demon) # Units the player can buy, in button order
+ENTITY_TYPES = SHOP + (Elf, Knight, Wizard, Necromancer, Skeleton, Elven_Knight, Kingsguard, Arrow, Fireball)
+ENTITY_TYPE_IDS = {entity_type: i for i, entity_type in enumerate(ENTITY_TYPES)} # Saved in snapshots, only ever append to ENTITY_TYPES
+
+def warm_assets():
+    """
+    Builds one of every entity type so all their animations are cached and baked before play
+    """
+    queue = RenderQueue()
+    for entity_type in ENTITY_TYPES:
+        entity = entity_type(0, 0)
+        if isinstance(entity, Sprite):
+            entity.animate() # Swaps the placeholder for its first frame
+        entity.submit(queue) # Also makes the shadow or ellipse surface it is drawn with
+
+class World:
+    """
+    The whole battle state with no rendering, step() advances it by exactly one tick
+    Seeding it makes a battle reproducible, and it never touches the display so it can run headless
+    engine = "numpy" moves and fights every unit in one batched pass, see numpy_engine.py
+    unit_stats overrides constructor arguments and cost per unit type for balancing, e.g. {"Imp": {"hp": 3.0, "cost": 2}}
+    starting_army = False leaves out the five imps every battle starts with, for filling the world in some other way
+    """
+    def __init__(self, seed = None, use_grid: bool = USE_SPATIAL_GRID, engine: str = "objects", retarget_ticks: int = RETARGET_TICKS,
+                 batch_hits: bool = BATCH_PROJECTILE_HITS, difficulty_ramp: float = DIFFICULTY_RAMP, unit_stats = None,
+                 starting_army: bool = True):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.engine_name = engine
+        self.difficulty_ramp = difficulty_ramp
+        self.unit_stats = unit_stats or {} # unit type name -> {argument: value}
+        self.use_grid = use_grid
+        self.batch_hits = batch_hits
+        self.retarget_ticks = retarget_ticks
+        if engine == "numpy":
+            from numpy_engine import NumpyEngine
+            self.engine = NumpyEngine(AVOID_RADIUS, prey = ALLY, hunters = ENEMY, retarget_ticks = retarget_ticks)
+        elif engine == "objects":
+            self.engine = None
         else:
-            sprite = None
+            raise ValueError("Unknown engine " + repr(engine))
+        self.pool = ProjectilePool()
+        self.registry = Registry(self.engine, self.pool)
+        self.coins = 0
+        self.difficulty = 1.0
+        self.tick = 0
+        self.timers = [] # Heap of (tick, order scheduled in, unit) for the next attack() of every ranged unit and summoner
+        self.timers_scheduled = 0
+        self.recording = None # Every input and per-tick checksum goes here once start_recording() is called
+
+        if starting_army:
+            center_x = WIDTH//2
+            center_y = HEIGHT//2
+            for offset_x, offset_y in ((0, 0), (-10, 0), (10, 0), (0, -10), (0, 10)):
+                self.summon(Imp, center_x + offset_x, center_y + offset_y)
+
+    def spawn(self, entity):
+        entity.world = self
+        self.registry.add(entity)
+        if getattr(entity, "attack_ticks", 0):
+            self.schedule_attack(entity, self.tick)
+        return entity
+
+    def schedule_attack(self, unit, tick):
+        """
+        Queues unit.attack() for the first tick from tick on where a roll with a 1 in attack_ticks chance would come up,
+        if it were rolled every tick. The wait until then follows the geometric distribution, so it is drawn once
+        by inverting its CDF instead of rolling every tick, which gives the same attacks per tick and gaps between them
+        """
+        chance = 1 / unit.attack_ticks
+        wait = int(math.log(1.0 - self.rng.random()) / math.log(1.0 - chance))
+        heapq.heappush(self.timers, (tick + wait, self.timers_scheduled, unit))
+        self.timers_scheduled += 1
 
-        if sprite:
-            ally_sprites.append(sprite)
-            all_sprites.append(sprite)
-            return True
-        else:
-            return False
+    def run_timers(self):
+        """
+        Calls attack() for every unit whose timer is due this tick and schedules its next one, skipping units that died
+        """
+        timers = self.timers
+        while timers and timers[0][0] <= self.tick:
+            tick, _, unit = heapq.heappop(timers)
+            if unit.alive:
+                unit.attack()
+                self.schedule_attack(unit, tick + 1)
+
+    def create(self, unit_type, x, y):
+        """
+        Builds a unit with this world's stat overrides, given in the same units as the constructor arguments
+        """
+        stats = self.unit_stats.get(unit_type.__name__, {})
+        return unit_type(x, y, **{argument: value for argument, value in stats.items() if argument != "cost"})
 
-    def trigger_wave():
-        global difficulty
+    def fire(self, projectile_type, x, y, speed, dirr, atk):
+        """
+        Launches a projectile, reusing a retired one when the pool has one
+        """
+        return self.spawn(self.pool.acquire(projectile_type, x, y, speed, dirr, atk))
 
-        if len(enemy_sprites) < round(difficulty):
-            random_type = random.choice([Elf, Knight, Wizard, Necromancer])
-            if difficulty >= 3.0:
-                prob = random.randint(1, 3 * FPS)
-                if difficulty >= 5.0 and prob == 1:
+    def summon(self, unit_type, x, y):
+        """
+        Spawns a unit centered on (x, y)
+        """
+        sprite = self.create(unit_type, x, y)
+        sprite.place(x - sprite.image.get_width()//2, y - sprite.image.get_height()//2)
+        return self.spawn(sprite)
+
+    def buy(self, unit_type):
+        """
+        Summons an ally in the middle of the map if there are enough coins. Returns True if it was bought
+        """
+        if self.recording is not None:
+            self.recording.buy(self.tick, SHOP.index(unit_type))
+        cost = self.cost(unit_type)
+        if self.coins < cost:
+            return False
+        self.coins += -cost
+        self.summon(unit_type, WIDTH//2, HEIGHT//2)
+        return True
+
+    def cost(self, unit_type):
+        return self.unit_stats.get(unit_type.__name__, {}).get("cost", unit_type.cost)
+
+    def move_allies(self, x, y):
+        if self.recording is not None:
+            self.recording.move(self.tick, x, y)
+        for sprite in self.registry.factions[ALLY]:
+            sprite.target_x, sprite.target_y = x, y
+
+    def trigger_wave(self):
+        rng = self.rng
+
+        if len(self.registry.factions[ENEMY]) < round(self.difficulty):
+            random_type = rng.choice([Elf, Knight, Wizard, Necromancer])
+            if self.difficulty >= 3.0:
+                prob = rng.randint(1, 3 * FPS)
+                if self.difficulty >= 5.0 and prob == 1:
                     random_type = Kingsguard
                 elif prob == 1 or prob == 2:
                     random_type = Elven_Knight
 
             # Set spawn at border
-            random_x = random.randint(0, WIDTH)
+            random_x = rng.randint(0, WIDTH)
             if random_x <= 10:
-                random_y = random.randint(0, HEIGHT)
+                random_y = rng.randint(0, HEIGHT)
             elif random_x > 10 and random_x < WIDTH:
-                random_y1 = random.randint(0, 10)
-                random_y2 = random.randint(HEIGHT - 10, HEIGHT)
-                random_y = random.choice([random_y1, random_y2])
+                random_y1 = rng.randint(0, 10)
+                random_y2 = rng.randint(HEIGHT - 10, HEIGHT)
+                random_y = rng.choice([random_y1, random_y2])
             elif random_x >= HEIGHT - 10:
-                random_y = random.randint(0, HEIGHT)
+                random_y = rng.randint(0, HEIGHT)
 
-            random_enemy = random_type(random_x, random_y)
-            enemy_sprites.append(random_enemy)
-            all_sprites.append(random_enemy)
+            self.spawn(self.create(random_type, random_x, random_y))
 
-    def update():
-        WINDOW.blit(BG, (0, 0))
+    def retarget(self):
+        """
+        Points every enemy whose target died or expired at the closest living ally, in one batch
+        Enemies whose target expired on the same tick are spread over the next retarget_ticks ticks for their next look,
+        so they do not all search again together. An enemy whose target died keeps the tick it was due to look on
+        """
+        hunters = [enemy for enemy in self.registry.factions[ENEMY] if enemy.alive and enemy.needs_target()]
+        if not hunters:
+            return
+        if self.use_grid:
+            index = NearestIndex(ally for ally in self.registry.factions[ALLY] if ally.alive)
+            targets = index.nearest_many((enemy.x, enemy.y) for enemy in hunters)
+        else:
+            targets = [enemy.find_ally() for enemy in hunters]
+        due = 0
+        for enemy, target in zip(hunters, targets):
+            enemy.target = target
+            if enemy.retarget_tick <= self.tick:
+                enemy.retarget_tick = self.tick + self.retarget_ticks + due % self.retarget_ticks
+                due += 1
+
+    def resolve_projectiles(self):
+        """
+        Tests every live projectile against every living ally in one pass after everything has moved,
+        then applies the damage in bulk
+        """
+        projectiles = [projectile for projectile in self.registry.projectiles if projectile.alive]
+        if not self.batch_hits:
+            for projectile in projectiles:
+                projectile.attack()
+            return
+
+        allies = [ally for ally in self.registry.factions[ALLY] if ally.alive] # Only enemies fire projectiles
+        ally_rects = [ally.rect for ally in allies]
+        damage = {}
+        for projectile in projectiles:
+            projectile.colliding = False
+            if projectile.out_of_bounds():
+                self.registry.kill(projectile)
+                continue
+            hits = projectile.rect.collidelistall(ally_rects)
+            if hits:
+                projectile.colliding = True
+                for i in hits:
+                    damage[allies[i]] = damage.get(allies[i], 0) + projectile.atk
+        for ally, amount in damage.items():
+            ally.taking_damage = True
+            ally.hp += -amount
+
+    def step(self):
+        profiler = PROFILER
+        self.trigger_wave()
+        profiler.mark("trigger_wave")
+        if self.engine is not None:
+            self.engine.step(self.tick)
+            profiler.mark("engine")
+        else:
+            self.retarget()
+            profiler.mark("retarget")
+        if profiler.enabled: # Per type, which costs a mark per entity
+            for entity in self.registry.all:
+                entity.update()
+                profiler.mark(type(entity).__name__ + ".update")
+        else:
+            for entity in self.registry.all:
+                entity.update()
+        spawned = len(self.registry.all)
+        self.run_timers()
+        for entity in itertools.islice(self.registry.all, spawned, None): # Summons and projectiles act on the tick they appear
+            entity.update()
+        profiler.mark("timers")
+        self.resolve_projectiles()
+        profiler.mark("projectile_hits")
+        self.registry.flush()
+        profiler.mark("flush")
+        self.tick += 1
+        if self.recording is not None:
+            self.recording.checksums.append(self.checksum())
+
+    def checksum(self):
+        """
+        CRC32 of the tick, coins, difficulty and the position and hp of every entity, in registry order
+        """
+        state = array("d", (self.tick, self.coins, self.difficulty))
+        for entity in self.registry.all:
+            state.extend((entity.x, entity.y, getattr(entity, "hp", 0.0)))
+        return zlib.crc32(state.tobytes())
+
+    def memory_report(self):
+        """
+        Returns {type name: {"count", "bytes", "bytes_per_entity"}} for the entities in play,
+        counting each entity with the floats and rect it owns but not the frames shared by its type
+        """
+        report = {}
+        for entity in self.registry.all:
+            size = sys.getsizeof(entity)
+            for cls in type(entity).__mro__:
+                for name in getattr(cls, "__slots__", ()):
+                    value = getattr(entity, name, None)
+                    if type(value) in (float, pygame.Rect):
+                        size += sys.getsizeof(value)
+            line = report.setdefault(type(entity).__name__, {"count": 0, "bytes": 0})
+            line["count"] += 1
+            line["bytes"] += size
+        for line in report.values():
+            line["bytes_per_entity"] = line["bytes"] / line["count"]
+        return report
+
+    def snapshot(self):
+        """
+        Returns everything needed to carry on from here as a snapshot.Snapshot, only take one between ticks
+        """
+        registry = self.registry
+        saved = snapshot.Snapshot(self.seed, self.engine_name, self.use_grid, self.batch_hits, self.retarget_ticks,
+                                  self.difficulty_ramp, self.unit_stats)
+        saved.tick = self.tick
+        saved.coins = self.coins
+        saved.difficulty = self.difficulty
+        saved.timers_scheduled = self.timers_scheduled
+        if registry.grid is not None:
+            saved.grid_size = (registry.grid.max_width, registry.grid.max_height)
+        saved.random_state = self.rng.getstate()
+        if self.engine is not None:
+            self.engine.store_targets()
+        saved.entities = [entity.snapshot_row(registry) for entity in registry.all]
+        index = registry.all.index
+        saved.timers = [(tick, order, index[unit]) for tick, order, unit in self.timers if unit in index]
+        if len(saved.timers) < len(self.timers):
+            heapq.heapify(saved.timers) # Leaving out the timers of units that died can break the heap order
+        return saved
+
+    def start_recording(self):
+        """
+        Records this world from now on, it must have been seeded and not stepped yet
+        """
+        if self.seed is None or self.tick != 0:
+            raise ValueError("Only a seeded world that has not been stepped can be recorded")
+        self.recording = recording.Recording(self.seed, self.engine_name, self.use_grid, self.batch_hits, self.retarget_ticks, self.difficulty_ramp)
+        return self.recording
+
+def restore(saved: snapshot.Snapshot):
+    """
+    Rebuilds the World a snapshot was taken of, stepping it gives exactly the ticks the original would have
+    """
+    # Every new entity and rect counts towards the next garbage collection, and thousands of them set off
+    # several full ones that walk the whole heap. Nothing made here can be garbage yet, so hold them off
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return rebuild(saved)
+    finally:
+        if collecting:
+            gc.enable()
+
+def rebuild(saved: snapshot.Snapshot):
+    """
+    restore() without holding off the garbage collector
+    """
+    world = World(saved.seed, unit_stats = saved.unit_stats, starting_army = False, **saved.options) # The snapshot has its own army
+    registry = world.registry
+
+    rows = saved.entities
+    entities = []
+    templates = {} # type id -> (type, one built the normal way)
+    for row in rows:
+        template = templates.get(row[0])
+        if template is None:
+            entity_type = ENTITY_TYPES[row[0]]
+            template = templates[row[0]] = (entity_type, entity_type(0, 0) if issubclass(entity_type, Projectile) else world.create(entity_type, 0, 0))
+        entity_type, template = template
+        entity = entity_type.__new__(entity_type) # Constructors would look up every animation again
+        entity.restore_row(row, template)
+        entity.world = world
+        entities.append(entity)
+    registry.restore(entities, [row[2] for row in rows], [row[3] for row in rows])
+    for projectile in registry.projectiles:
+        world.pool.adopt(projectile)
+    for entity, row in zip(entities, saved.entities):
+        if row[14] >= 0:
+            entity.target = entities[row[14]]
+    if world.engine is not None:
+        world.engine.load_targets()
+    if registry.grid is not None:
+        registry.grid.max_width, registry.grid.max_height = saved.grid_size
+
+    world.timers = [(tick, order, entities[i]) for tick, order, i in saved.timers]
+    world.timers_scheduled = saved.timers_scheduled
+    world.rng.setstate(saved.random_state)
+    world.coins = saved.coins
+    world.difficulty = saved.difficulty
+    world.tick = saved.tick
+    return world
+
+class Rewind:
+    """
+    Ring buffer of recent snapshots of a world, about one every interval ticks, for going back in time
+    They are kept as snapshot.Snapshot objects, packing them would only add to the frame they are taken in
+    """
+    def __init__(self, capacity: int = REWIND_SNAPSHOTS, interval: int = REWIND_TICKS):
+        self.interval = interval
+        self.snapshots = deque(maxlen = capacity) # (tick, snapshot.Snapshot), oldest first
+        self.next_tick = interval # First tick the next snapshot is due on
+        self.cost = 0.0 # Seconds the last snapshot took
+
+    def record(self, world: World, spare: float = None):
+        """
+        Call after every step, takes a snapshot when one is due
+        spare is how many seconds are left in this frame. A snapshot that would not fit waits for a later tick,
+        at most another interval, so it does not make a frame that is already late any later
+        """
+        if world.tick < self.next_tick:
+            return
+        if spare is not None and self.cost > spare and world.tick - self.next_tick < self.interval:
+            return
+        start = time.perf_counter()
+        self.snapshots.append((world.tick, world.snapshot()))
+        self.cost = time.perf_counter() - start
+        self.next_tick = world.tick + self.interval
+
+    def rewind(self, world: World):
+        """
+        Returns the world as of the newest snapshot from before its current tick, forgetting that one and any after it.
+        Returns None if the buffer does not reach that far back
+        """
+        while self.snapshots:
+            tick, saved = self.snapshots.pop()
+            if tick < world.tick:
+                self.next_tick = tick + self.interval
+                return restore(saved)
+        return None
+
+def replay(path: str, verify: bool = True):
+    """
+    Re-runs a recorded session headless as fast as possible, returns how many seconds every tick took
+    Raises ValueError on the first tick that does not end in the recorded state
+    """
+    session = recording.load(path)
+    world = World(session.seed, **session.options)
+    inputs = session.inputs
+    next_input = 0
+    tick_times = []
+    for tick, expected in enumerate(session.checksums):
+        while next_input < len(inputs) and inputs[next_input][0] == tick:
+            _, kind, x, y = inputs[next_input]
+            if kind == recording.BUY:
+                world.buy(SHOP[x])
+            else:
+                world.move_allies(x, y)
+            next_input += 1
+        start = time.perf_counter()
+        world.step()
+        tick_times.append(time.perf_counter() - start)
+        if verify and world.checksum() != expected:
+            raise ValueError("Replay of " + path + " diverged from the recording on tick " + str(tick))
+    return tick_times
+
+class RenderQueue:
+    """
+    Blit commands submitted by every entity for one frame, issued together through a single Surface.blits() call
+    Floor commands, the shadows, go first in the order they came in. Sprites go over them sorted by depth, the
+    bottom edge of the sprite, so whatever stands lower on the screen is drawn in front. Equal depths keep their order
+    """
+    def __init__(self):
+        self.floor = [] # (surface, position)
+        self.sprites = [] # (depth, surface, position)
+
+    def flush(self, target: pygame.Surface):
+        """
+        Draws and clears every queued command. Returns the areas drawn over
+        """
+        sprites = self.sprites
+        sprites.sort(key = itemgetter(0))
+        blits = self.floor
+        blits += map(itemgetter(1, 2), sprites)
+        drawn = target.blits(blits)
+        blits.clear()
+        sprites.clear()
+        return drawn
+
+class Renderer:
+    """
+    Draws a World onto the window, only repainting and flipping the parts of the screen that changed
+    The background and the UI that never changes are pre-rendered once into cached layers, every frame
+    the areas drawn over last frame are restored from them and only those plus the new areas are updated
+    """
+    def __init__(self, window: pygame.Surface, font: pygame.font.Font, dirty_rects: bool = DIRTY_RECTS):
+        self.window = window
+        self.font = font
+        self.dirty_rects = dirty_rects
+        self.coin = pygame.transform.scale(ASSETS.image("coin.png"), (12, 15))
+        self.background = pygame.transform.scale(ASSETS.image("dungeon.png"), (WIDTH, HEIGHT)).convert()
+
+        # (button, unit type, offset of the unit art inside the button)
+        self.buttons = [(pygame.Rect(10, HEIGHT - 50, 25, 25), Imp, (4, 2)),
+                        (pygame.Rect(40, HEIGHT - 50, 25, 25), Wogol, (4, 0)),
+                        (pygame.Rect(70, HEIGHT - 50, 25, 25), Chort, (4, -3)),
+                        (pygame.Rect(100, HEIGHT - 50, 25, 25), Big_Demon, (-4, -9))]
+        self.chrome = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA) # UI drawn over the sprites
+        self.chrome_rects = [] # Areas of the chrome layer that are not empty
+        self.draw_chrome()
+
+        self.coins_shown = None
+        self.coins_label = None
+        self.coins_rect = pygame.Rect(25, 24, 0, 0)
+        self.queue = RenderQueue()
+        self.drawn = [] # Areas drawn over last frame, restored from the background next frame
+        self.overlay_font = pygame.font.Font(os.path.join("assets", "Silver.ttf"), 16)
+        # The overlay keeps its own text cache and backdrop, so its lines that change every frame neither push the HUD
+        # out of TEXT nor show up in the allocations it reports
+        self.overlay_text = TextCache(capacity = 32)
+        self.overlay_area = pygame.Rect(WIDTH - 200, 0, 200, 118)
+        self.overlay_shade = pygame.Surface(self.overlay_area.size, pygame.SRCALPHA)
+        self.overlay_shade.fill((0, 0, 0, 160))
+        self.full_redraw = True
+
+        self.frames = 0
+        self.dirty_area = 0 # Pixels sent to the display last frame
+        self.total_dirty_area = 0
+
+    def draw_chrome(self):
+        chrome = self.chrome
+        # Coins
+        self.chrome_rects.append(chrome.blit(self.coin, (10, 27)))
+
+        for button, unit_type, (offset_x, offset_y) in self.buttons:
+            # Sprite Summon Art
+            art = ASSETS.frames(unit_type.__name__.lower(), "idle")[0]
+            area = chrome.blit(art, (button.x + offset_x, button.y + offset_y))
+
+            # Sprite Summon Box
+            area.union_ip(pygame.draw.rect(chrome, (180, 180, 180), button, 1))
+
+            # Sprite Summon Cost
+            area.union_ip(chrome.blit(self.coin, (button.x + 15, button.y + 15)))
+            area.union_ip(chrome.blit(TEXT.render(self.font, str(unit_type.cost), (0, 0, 0)), (button.x + 17, button.y + 15)))
+            self.chrome_rects.append(area)
+
+    def draw(self, world: World):
+        profiler = PROFILER
+        window = self.window
+        background = self.background
+        full = self.full_redraw or not self.dirty_rects
+        if full:
+            window.blit(background, (0, 0))
+            dirty = [window.get_rect()]
+        else:
+            dirty = self.drawn
+            window.blits([(background, rect, rect) for rect in dirty], doreturn = False)
+
+        if world.coins != self.coins_shown:
+            window.blit(background, self.coins_rect, self.coins_rect)
+            dirty.append(self.coins_rect)
+            self.coins_shown = world.coins
+            self.coins_label = TEXT.render(self.font, str(world.coins), (255, 255, 255))
+            self.coins_rect = self.coins_label.get_rect(topleft = (25, 24))
+            dirty.append(self.coins_rect)
+
+        # The UI has translucent edges, so it is always laid over plain background rather than over itself.
+        # Repainting an untouched part gives the same pixels, so it only has to be sent to the display if something changed there
+        ui = self.chrome_rects + [self.coins_rect]
+        for rect in ui:
+            window.blit(background, rect, rect)
+        profiler.mark("background")
+
+        queue = self.queue
+        if profiler.enabled:
+            for sprite in world.registry.all:
+                sprite.submit(queue)
+                profiler.mark(type(sprite).__name__ + ".submit")
+        else:
+            for sprite in world.registry.all:
+                sprite.submit(queue)
+        drawn = queue.flush(window)
+        dirty += drawn
+        profiler.mark("blits")
+
+        for rect in self.chrome_rects:
+            window.blit(self.chrome, rect, rect)
+        window.blit(self.coins_label, self.coins_rect)
+        profiler.mark("ui")
+
+        if profiler.overlay:
+            overlay = self.draw_overlay(profiler)
+            drawn.append(overlay)
+            dirty.append(overlay)
+            profiler.mark("overlay")
+
+        if full:
+            pygame.display.update()
+            self.dirty_area = WIDTH * HEIGHT
+            self.full_redraw = False
+        else:
+            dirty += [rect for rect in ui if rect.collidelist(dirty) != -1]
+            pygame.display.update(dirty)
+            self.dirty_area = sum(rect.width * rect.height for rect in dirty)
+        profiler.mark("flip")
+        self.drawn = drawn
+        self.frames += 1
+        self.total_dirty_area += self.dirty_area
+
+    def draw_overlay(self, profiler: Profiler):
+        """
+        Frame time graph of the kept frames against the 60 FPS budget, percentiles and the slowest phases of the last frame.
+        Returns the area drawn over
+        """
+        BUDGET = 1 / FPS
+        area = self.overlay_area
+        window = self.window
+        window.blit(self.overlay_shade, area)
+
+        graph = pygame.Rect(area.x + 5, area.y + 5, area.width - 10, 40)
+        pygame.draw.line(window, (90, 200, 90), (graph.x, graph.centery), (graph.right, graph.centery)) # The budget sits halfway up
+        frames = list(profiler.history)[-graph.width:]
+        for i, (total, phases, counts) in enumerate(frames):
+            height = min(graph.height, int(total / BUDGET * graph.height / 2))
+            colour = (200, 90, 90) if total > BUDGET else (200, 200, 200)
+            pygame.draw.line(window, colour, (graph.x + i, graph.bottom), (graph.x + i, graph.bottom - height))
+
+        lines = ["p50 %.1f p99 %.1f ms" % (profiler.percentile(.5) * 1000, profiler.percentile(.99) * 1000)]
+        if frames:
+            total, phases, counts = frames[-1]
+            lines.append("%d entities %d allocs" % (counts.get("entities", 0), counts.get("surfaces_allocated", 0)))
+            lines.append("%.0f ticks/s %.0f fps at %dx" % (counts.get("ticks_per_second", 0), counts.get("frames_per_second", 0), counts.get("speed", 1)))
+            slowest = max(phases, key = phases.get) if phases else ""
+            lines.append("%s %.1f ms" % (slowest, phases.get(slowest, 0.0) * 1000))
+        for i, line in enumerate(lines):
+            window.blit(self.overlay_text.render(self.overlay_font, line, (255, 255, 255)), (area.x + 5, graph.bottom + 4 + i * self.overlay_font.get_linesize()))
+        return area
+
+    def report(self):
+        """
+        Returns {"frames", "dirty_area", "average_dirty_area", "average_coverage"}, areas in pixels
+        Overlapping rects are counted once per rect, so this is what the display is asked to update
+        """
+        average = self.total_dirty_area / self.frames if self.frames else 0.0
+        return {"frames": self.frames, "dirty_area": self.dirty_area,
+                "average_dirty_area": average, "average_coverage": average / (WIDTH * HEIGHT)}
+
+class TimeScale:
+    """
+    Turns real time into whole logic ticks at the chosen speed, so the game runs at the same pace whatever the frame rate
+    and a frame runs as many ticks as the time since the last one is worth. World.step() is the only thing that advances
+    the battle and inputs land between ticks, so the outcome only depends on the inputs and the ticks they were given on
+    Frames that went over budget are followed by undrawn ones, at most max_skipped in a row, to give the logic the time back
+    """
+    def __init__(self, speeds = SPEEDS, max_ticks: int = MAX_TICKS_PER_FRAME, max_skipped: int = MAX_SKIPPED_FRAMES):
+        self.speeds = speeds
+        self.speed = speeds[0]
+        self.max_ticks = max_ticks
+        self.max_skipped = max_skipped
+        self.owed = 0.0 # Ticks worth of time not run yet
+        self.over_budget = False # Whether the last frame took longer than 1/FPS seconds to run and draw
+        self.skipped = 0 # Frames in a row left undrawn
+
+        # Measured over the last second
+        self.ticks_per_second = 0.0
+        self.frames_per_second = 0.0
+        self.ticks = 0
+        self.frames = 0
+        self.window_start = None
+
+    def cycle(self):
+        """
+        Switches to the next speed, back to the first after the fastest
+        """
+        self.speed = self.speeds[(self.speeds.index(self.speed) + 1) % len(self.speeds)]
+        return self.speed
 
-        # Draw shadows
-        for sprite in all_sprites:
-            if Projectile not in type(sprite).__bases__:
-                pygame.draw.ellipse(WINDOW, (45, 45, 45), pygame.Rect(sprite.pos.x, sprite.pos.y + sprite.image.get_height(), sprite.image.get_width(), 5))
+    def advance(self, seconds: float):
+        """
+        Adds the real time since the last frame. Returns how many ticks to run now
+        """
+        self.owed += seconds * FPS * self.speed
+        ticks = int(self.owed)
+        self.owed -= ticks
+        if ticks > self.max_ticks:
+            ticks = self.max_ticks
+        self.ticks += ticks
+        return ticks
+
+    def should_draw(self):
+        if self.over_budget and self.skipped < self.max_skipped:
+            self.skipped += 1
+            return False
+        self.skipped = 0
+        return True
 
-        trigger_wave()
-        for sprite in all_sprites:
-            sprite.update()
-        draw_ui()
+    def frame_done(self, busy: float, drawn: bool, now: float):
+        """
+        busy is how long the frame took to run and draw in seconds, leaving out any time spent waiting for the next one
+        """
+        self.over_budget = busy > 1 / FPS
+        if drawn:
+            self.frames += 1
+        if self.window_start is None:
+            self.window_start = now
+        elif now - self.window_start >= 1.0:
+            self.ticks_per_second = self.ticks / (now - self.window_start)
+            self.frames_per_second = self.frames / (now - self.window_start)
+            self.ticks = 0
+            self.frames = 0
+            self.window_start = now
+
+def loading_screen(window: pygame.Surface, font: pygame.font.Font, clock):
+    """
+    Shows a progress bar while every image is preloaded. Returns False if the window was closed first
+    """
+    ASSETS.start_preload()
+    label = font.render("Loading", 1, (255, 255, 255))
+    bar = pygame.Rect(WIDTH//4, HEIGHT//2, WIDTH//2, 10)
+    while True:
+        done = ASSETS.poll_preload()
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+        window.fill((0, 0, 0))
+        window.blit(label, label.get_rect(midbottom = (WIDTH//2, bar.y - 5)))
+        pygame.draw.rect(window, (180, 180, 180), (bar.x, bar.y, int(bar.width * done), bar.height))
+        pygame.draw.rect(window, (180, 180, 180), bar, 1)
         pygame.display.update()
+        if done >= 1.0:
+            return True
+        clock.tick(FPS)
+
+def main(record: str = None, trace: str = None):
+    """
+    Plays the game, and saves every input to the file record when given so the session can be replayed
+    trace streams the profiler to a file from the first frame, F3 shows the profiler overlay and Tab cycles the game speed
+    Backspace goes back a second, F5 saves the battle to SNAPSHOT_PATH and F9 loads it, going back and loading are off while recording
+    """
+    pygame.init()
+    pygame.font.init()
+    window = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Battles")
+    clock = pygame.time.Clock()
+    running = True
+    main_font = pygame.font.Font(os.path.join("assets", "Silver.ttf"), 25)
+
+    if not loading_screen(window, main_font, clock):
+        return
+    renderer = Renderer(window, main_font)
+    warm_assets()
+    ASSETS.seal() # Nothing is read from disk inside the loop
+    hotkeys = {pygame.K_1: Imp, pygame.K_2: Wogol, pygame.K_3: Chort, pygame.K_4: Big_Demon}
+    time_scale = TimeScale()
+
+    if record:
+        world = World(seed = random.randrange(2 ** 32))
+        world.start_recording()
+        rewind = None # Going back or loading would leave the recording behind
+    else:
+        world = World()
+        rewind = Rewind()
+
+    def button_event(mouse_pos):
+        """
+        Performs the behavior of buttons. Returns True if a unit was bought
+        """
+        for button, unit_type, offset in renderer.buttons:
+            if button.collidepoint(mouse_pos):
+                return world.buy(unit_type)
+        return False
+
+    if trace:
+        PROFILER.start_trace(trace)
 
+    last = time.perf_counter()
     while running:
         clock.tick(FPS)
-        update()
+        now = time.perf_counter()
+        ticks = time_scale.advance(now - last)
+        last = now
+        PROFILER.begin_frame()
+        for _ in range(ticks):
+            world.step()
+            if rewind is not None:
+                rewind.record(world, 1 / FPS - (time.perf_counter() - now))
+        drawn = time_scale.should_draw()
+        if drawn:
+            renderer.draw(world)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+                if record:
+                    world.recording.save(record)
+                PROFILER.stop_trace()
             else:
                 if event.type == pygame.MOUSEBUTTONDOWN and pygame.mouse.get_pressed()[0]: # Left click, (leftclick, middleclick, rightclick)
                     mouse_pos = pygame.mouse.get_pos()
-                    if not button_event(mouse_pos, None):
-                        for sprite in ally_sprites:
-                            sprite.target_x, sprite.target_y = mouse_pos
+                    if not button_event(mouse_pos):
+                        world.move_allies(*mouse_pos)
                 elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_1:
-                        button_event(mouse_pos, Imp)
-                    elif event.key == pygame.K_2:
-                        button_event(mouse_pos, Wogol)
-                    elif event.key == pygame.K_3:
-                        button_event(mouse_pos, Chort)
-                    elif event.key == pygame.K_4:
-                        button_event(mouse_pos, Big_Demon)
-main()
+                    if event.key in hotkeys:
+                        world.buy(hotkeys[event.key])
+                    elif event.key == pygame.K_F3:
+                        PROFILER.toggle_overlay()
+                    elif event.key == pygame.K_TAB:
+                        pygame.display.set_caption("Battles" if time_scale.cycle() == 1 else "Battles " + str(time_scale.speed) + "x")
+                    elif event.key == pygame.K_F5:
+                        world.snapshot().save(SNAPSHOT_PATH)
+                    elif rewind is not None and event.key == pygame.K_BACKSPACE:
+                        earlier = rewind.rewind(world)
+                        if earlier is not None:
+                            world = earlier
+                            renderer.full_redraw = True
+                    elif rewind is not None and event.key == pygame.K_F9 and os.path.exists(SNAPSHOT_PATH):
+                        world = restore(snapshot.load(SNAPSHOT_PATH))
+                        rewind = Rewind()
+                        renderer.full_redraw = True
+        PROFILER.mark("events")
+        PROFILER.count("entities", len(world.registry.all))
+        PROFILER.count("ticks", ticks)
+        PROFILER.count("ticks_per_second", round(time_scale.ticks_per_second, 1))
+        PROFILER.count("frames_per_second", round(time_scale.frames_per_second, 1))
+        PROFILER.count("speed", time_scale.speed)
+        PROFILER.end_frame()
+        time_scale.frame_done(time.perf_counter() - now, drawn, now)
+
+def main_replay(path: str, verify: bool = True):
+    tick_times = replay(path, verify)
+    total = sum(tick_times)
+    print(len(tick_times), "ticks in", round(total, 3), "s,", round(len(tick_times) / total, 1) if total else 0, "ticks/s", "verified" if verify else "not verified")
+    for tick, seconds in sorted(enumerate(tick_times), key = lambda slow: -slow[1])[:5]:
+        print("tick", tick, round(seconds * 1000, 3), "ms")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = "Battles")
+    parser.add_argument("--record", metavar = "PATH", help = "Save every input of this session to PATH")
+    parser.add_argument("--replay", metavar = "PATH", help = "Re-run a recorded session headless and check it against the recording")
+    parser.add_argument("--no-verify", action = "store_true", help = "With --replay, skip the per-tick checksums")
+    parser.add_argument("--profile", metavar = "PATH", help = "Write a per-phase trace of every frame to PATH, JSON lines if it ends in .json, CSV otherwise")
+    args = parser.parse_args()
+    if args.replay:
+        main_replay(args.replay, not args.no_verify)
+    else:
+        main(args.record, args.profile)
@@ -0,0 +1,451 @@
+"""
+Struct-of-arrays movement engine for Battles
+Opt in with World(engine = "numpy"), needs numpy
+
+Positions, velocities, speeds, hp, atk and faction of every unit live in contiguous arrays,
+and targeting, steering, separation, integration and melee are done for the whole population
+in one batched pass per tick. Projectile positions and velocities are kept the same way.
+Units and projectiles still exist as objects for animation, projectile hits and drawing,
+the engine writes the results back to them every tick.
+
+Unlike the object path, every unit steers from the positions at the start of the tick instead of
+seeing the units updated before it, so battles are similar but not identical to World(engine = "objects")
+"""
+
+import math
+from itertools import chain, compress
+import numpy as np
+
+PREY = 0
+HUNTER = 1
+DENSE_PAIRS = 1 << 18 # Up to this many query and point pairs, nearest() compares them all instead of searching a grid
+MIN_CELL_SIZE = 16.0 # Smallest grid cell nearest() uses, like main.NearestIndex, so a tight cluster cannot shrink the cells to a pixel
+RING_CELL_COST = 16 # Rough cost of visiting one grid cell in nearest(), in compared pairs
+CANDIDATE_COST = 8 # Rough cost of checking one point found in those cells, in compared pairs
+DENSE_CHUNK = 1 << 16 # Most pairs compared at once when comparing every pair, small enough to stay in cache
+
+def neighbour_pairs(pos, cell_size):
+    """
+    Returns index arrays (i, j) of every ordered pair of distinct points in the same or adjacent grid cells
+    Any two points closer than cell_size on both axes are guaranteed to be in the result
+    """
+    n = len(pos)
+    if n < 2:
+        empty = np.empty(0, dtype = np.int64)
+        return empty, empty
+
+    cells = np.floor(pos / cell_size).astype(np.int64)
+    cells -= cells.min(axis = 0) - 1 # Leave an empty border so neighbour keys never wrap onto another row
+    height = int(cells[:, 1].max()) + 2
+    keys = cells[:, 0] * height + cells[:, 1]
+    order = np.argsort(keys, kind = "stable")
+    sorted_keys = keys[order]
+
+    pairs_i = []
+    pairs_j = []
+    everyone = np.arange(n)
+    for offset_x in (-1, 0, 1):
+        for offset_y in (-1, 0, 1):
+            neighbour_keys = keys + offset_x * height + offset_y
+            start = np.searchsorted(sorted_keys, neighbour_keys, "left")
+            counts = np.searchsorted(sorted_keys, neighbour_keys, "right") - start
+            i = np.repeat(everyone, counts)
+            # Position of each pair inside its run of neighbours
+            run_offsets = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+            pairs_i.append(i)
+            pairs_j.append(order[np.repeat(start, counts) + run_offsets])
+
+    i = np.concatenate(pairs_i)
+    j = np.concatenate(pairs_j)
+    distinct = i != j
+    return i[distinct], j[distinct]
+
+def ring_cells(cells, radius, span):
+    """
+    Returns (which, ring cells) where ring cells are the cells exactly radius[k] cells away from cells[k]
+    that lie inside the grid from (0, 0) to span, and which gives the k each belongs to
+    """
+    cx = cells[:, 0, None]
+    cy = cells[:, 1, None]
+    r = radius[:, None]
+    # Bottom, right, top then left side, each one cell short so the corners are not counted twice.
+    # A side is the line where one axis is fixed, walked from low to high along the other
+    fixed_axis = np.array((1, 0, 1, 0))
+    fixed = np.concatenate((cy - r, cx + r, cy + r, cx - r), axis = 1)
+    low = np.concatenate((cx - r, cy - r, cx - r + 1, cy - r + 1), axis = 1)
+    high = low + np.maximum(2 * r - 1, 0)
+    low = np.maximum(low, 0)
+    high = np.minimum(high, span[1 - fixed_axis])
+    lengths = np.where((fixed >= 0) & (fixed <= span[fixed_axis]), np.maximum(high - low + 1, 0), 0)
+    lengths[:, 1:] *= radius[:, None] > 0 # Ring 0 is the one cell itself
+
+    lengths = lengths.ravel()
+    which = np.repeat(np.arange(len(cells)), 4)
+    sides = np.tile(fixed_axis, len(cells))
+    total = lengths.sum()
+    along = np.repeat(low.ravel(), lengths) + np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    fixed = np.repeat(fixed.ravel(), lengths)
+    y_fixed = np.repeat(sides, lengths) == 1
+    ring = np.stack((np.where(y_fixed, along, fixed), np.where(y_fixed, fixed, along)), axis = 1)
+    return np.repeat(which, lengths), ring
+
+def nearest_dense(points, queries):
+    """
+    nearest() by comparing every pair, a chunk of queries at a time so at most about DENSE_CHUNK distances are held at once
+    """
+    found = np.empty(len(queries), dtype = np.int64)
+    chunk = max(1, DENSE_CHUNK // len(points))
+    for start in range(0, len(queries), chunk):
+        part = queries[start:start + chunk]
+        delta_x = part[:, 0, None] - points[:, 0]
+        delta_y = part[:, 1, None] - points[:, 1]
+        found[start:start + chunk] = (delta_x * delta_x + delta_y * delta_y).argmin(axis = 1)
+    return found
+
+def nearest(points, queries, cell_size = None):
+    """
+    Returns the index of the closest point for every query, ties go to the lowest index
+    Points are bucketed into a grid and every query searches outward ring by ring like main.NearestIndex,
+    so the work grows with the points near each query instead of with every point.
+    Once walking the rings has cost more than comparing every pair would, e.g. for queries far from a tight cluster,
+    it compares every pair for the queries still searching
+    """
+    found = np.full(len(queries), -1, dtype = np.int64)
+    if len(points) == 0 or len(queries) == 0:
+        return found
+    if len(points) * len(queries) <= DENSE_PAIRS: # Cheaper than setting up the grid
+        return nearest_dense(points, queries)
+    if cell_size is None:
+        extent = float((points.max(axis = 0) - points.min(axis = 0)).max())
+        cell_size = max(MIN_CELL_SIZE, extent / math.sqrt(len(points))) # About one point per cell
+    cells = np.floor(points / cell_size).astype(np.int64)
+    low = cells.min(axis = 0)
+    cells -= low
+    span = cells.max(axis = 0)
+    query_cells = np.floor(queries / cell_size).astype(np.int64) - low
+
+    best = np.full(len(queries), np.inf) # Squared distance to the closest point found so far
+    # Rings that do not reach the grid are empty, so each query starts at the first one that does,
+    # and rings past the furthest cell of the grid are empty too
+    radius = np.maximum(np.maximum(-query_cells, query_cells - span).max(axis = 1), 0)
+    furthest = np.maximum(query_cells, span - query_cells).max(axis = 1)
+    height = int(span[1]) + 1
+    keys = cells[:, 0] * height + cells[:, 1]
+    order = np.argsort(keys, kind = "stable")
+    sorted_keys = keys[order]
+    pending = np.arange(len(queries))
+    spent = 0 # Work done so far, counted in compared pairs
+    budget = len(points) * len(queries)
+    while len(pending):
+        which, neighbour_cells = ring_cells(query_cells[pending], radius[pending], span)
+        neighbour_keys = neighbour_cells[:, 0] * height + neighbour_cells[:, 1]
+        start = np.searchsorted(sorted_keys, neighbour_keys, "left")
+        counts = np.searchsorted(sorted_keys, neighbour_keys, "right") - start
+        spent += len(neighbour_keys) * RING_CELL_COST + int(counts.sum()) * CANDIDATE_COST
+        if spent > budget: # Cheaper to finish off by comparing every pair
+            found[pending] = nearest_dense(points, queries[pending])
+            break
+        i = pending[np.repeat(which, counts)]
+        run_offsets = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(start, counts) + run_offsets]
+        if len(i):
+            delta = queries[i] - points[j]
+            distance = delta[:, 0] * delta[:, 0] + delta[:, 1] * delta[:, 1]
+            # Closest candidate of every query, lowest index first among equals. Candidates come grouped by query
+            first = np.flatnonzero(np.concatenate(([True], i[1:] != i[:-1])))
+            closest = np.minimum.reduceat(distance, first)
+            lengths = np.diff(np.append(first, len(i)))
+            j = np.minimum.reduceat(np.where(distance == np.repeat(closest, lengths), j, len(points)), first)
+            i = i[first]
+            better = (closest < best[i]) | ((closest == best[i]) & (j < found[i]))
+            best[i[better]] = closest[better]
+            found[i[better]] = j[better]
+        # Every cell further out is at least radius cells away
+        reach = radius[pending] * cell_size
+        pending = pending[(best[pending] >= reach * reach) & (radius[pending] < furthest[pending])]
+        radius[pending] += 1
+    return found
+
+class SlotArrays:
+    """
+    Parallel arrays indexed by slot plus the objects they mirror, slots are swap-removed like EntitySet
+    """
+    def __init__(self, fields, capacity: int = 256):
+        self.fields = fields # (name, columns, dtype)
+        self.entities = [] # slot -> object
+        self.count = 0
+        self.capacity = 0
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        for name, width, dtype in self.fields:
+            array = np.zeros((capacity, width) if width > 1 else capacity, dtype = dtype)
+            if self.capacity:
+                array[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def add(self, entity):
+        if self.count == self.capacity:
+            self.allocate(self.capacity * 2)
+        slot = self.count
+        entity.slot = slot
+        self.entities.append(entity)
+        self.count += 1
+        return slot
+
+    def extend(self, entities):
+        """
+        add() for every entity of a list, returns the slot of the first
+        """
+        start = self.count
+        capacity = self.capacity
+        while capacity < start + len(entities):
+            capacity *= 2
+        if capacity != self.capacity:
+            self.allocate(capacity)
+        for slot, entity in enumerate(entities, start):
+            entity.slot = slot
+        self.entities.extend(entities)
+        self.count += len(entities)
+        return start
+
+    def remove(self, entity):
+        slot = entity.slot
+        last = self.count - 1
+        if slot != last:
+            for name, width, dtype in self.fields:
+                array = getattr(self, name)
+                array[slot] = array[last]
+            moved = self.entities[last]
+            moved.slot = slot
+            self.entities[slot] = moved
+        self.entities.pop()
+        entity.slot = None
+        self.count = last
+
+class NumpyEngine:
+    """
+    Unit and projectile state stored as struct-of-arrays
+    """
+    UNIT_FIELDS = (("pos", 2, float), ("vel", 2, float), ("target", 2, float), ("half_size", 2, float), ("size", 2, float),
+                   ("dir", 1, float), ("speed", 1, float), ("hp", 1, float), ("atk", 1, float), ("faction", 1, np.int8),
+                   ("chase", 1, np.int64), ("retarget_tick", 1, np.int64))
+    PROJECTILE_FIELDS = (("pos", 2, float), ("vel", 2, float))
+
+    def __init__(self, avoid_radius: float, prey, hunters, retarget_ticks: int = 10):
+        self.avoid_radius = avoid_radius
+        self.retarget_ticks = retarget_ticks # How long hunters chase the same prey before looking for closer prey
+        self.codes = {prey: PREY, hunters: HUNTER} # Hunters chase the closest living prey
+        self.units = SlotArrays(self.UNIT_FIELDS)
+        self.projectiles = SlotArrays(self.PROJECTILE_FIELDS)
+
+    def add(self, unit):
+        units = self.units
+        slot = units.add(unit)
+        units.pos[slot] = (unit.x, unit.y)
+        units.vel[slot] = (unit.vel_x, unit.vel_y)
+        units.dir[slot] = unit.dir
+        units.speed[slot] = unit.speed
+        units.hp[slot] = unit.hp
+        units.atk[slot] = unit.atk if unit.melee else 0.0 # Ranged units and summoners attack through their objects
+        units.size[slot] = unit.rect.size
+        units.faction[slot] = self.codes[unit.faction]
+        units.chase[slot] = -1 # Slot of the prey it chases, -1 until it picks one
+        units.retarget_tick[slot] = 0
+
+    def extend(self, new_units):
+        """
+        add() for every unit of a list, filling the arrays in one go
+        """
+        units = self.units
+        start = units.extend(new_units)
+        end = units.count
+        codes = self.codes
+        state = np.fromiter(chain.from_iterable((unit.x, unit.y, unit.vel_x, unit.vel_y, unit.dir, unit.speed, unit.hp, unit.atk if unit.melee else 0.0,
+                                                 unit.rect.width, unit.rect.height, codes[unit.faction]) for unit in new_units),
+                            dtype = float, count = 11 * len(new_units)).reshape(len(new_units), 11)
+        units.pos[start:end] = state[:, 0:2]
+        units.vel[start:end] = state[:, 2:4]
+        units.dir[start:end] = state[:, 4]
+        units.speed[start:end] = state[:, 5]
+        units.hp[start:end] = state[:, 6]
+        units.atk[start:end] = state[:, 7]
+        units.size[start:end] = state[:, 8:10]
+        units.faction[start:end] = state[:, 10]
+        units.chase[start:end] = -1
+        units.retarget_tick[start:end] = 0
+
+    def remove(self, unit):
+        units = self.units
+        slot = unit.slot
+        last = units.count - 1
+        units.remove(unit)
+        # Hunters chasing it look for new prey, those chasing the unit moved into its slot follow it
+        chase = units.chase[:units.count]
+        chase[chase == slot] = -1
+        if slot != last:
+            chase[chase == last] = slot
+
+    def store_targets(self):
+        """
+        Copies every hunter's prey and retarget tick to its object's target and retarget_tick, for saving
+        """
+        units = self.units
+        n = units.count
+        for unit, chase, retarget_tick, faction in zip(units.entities, units.chase[:n].tolist(), units.retarget_tick[:n].tolist(), units.faction[:n].tolist()):
+            if faction == HUNTER:
+                unit.target = units.entities[chase] if chase >= 0 else None
+                unit.retarget_tick = retarget_tick
+
+    def load_targets(self):
+        """
+        The opposite of store_targets(), once every unit is back in its slot
+        """
+        units = self.units
+        for unit in units.entities:
+            if self.codes[unit.faction] == HUNTER:
+                units.chase[unit.slot] = -1 if unit.target is None else unit.target.slot
+                units.retarget_tick[unit.slot] = unit.retarget_tick
+
+    def add_projectile(self, projectile):
+        projectiles = self.projectiles
+        slot = projectiles.add(projectile)
+        projectiles.pos[slot] = (projectile.x, projectile.y)
+        # Projectiles fly in a straight line, so their velocity never changes after launch
+        projectiles.vel[slot] = (math.cos(projectile.dir) * projectile.speed, math.sin(projectile.dir) * projectile.speed)
+
+    def extend_projectiles(self, new_projectiles):
+        """
+        add_projectile() for every projectile of a list
+        """
+        projectiles = self.projectiles
+        start = projectiles.extend(new_projectiles)
+        end = projectiles.count
+        state = np.array([(projectile.x, projectile.y, math.cos(projectile.dir) * projectile.speed, math.sin(projectile.dir) * projectile.speed)
+                          for projectile in new_projectiles], dtype = float).reshape(len(new_projectiles), 4)
+        projectiles.pos[start:end] = state[:, 0:2]
+        projectiles.vel[start:end] = state[:, 2:4]
+
+    def remove_projectile(self, projectile):
+        self.projectiles.remove(projectile)
+
+    def gather(self):
+        """
+        Pulls the state that objects may have changed since last tick: hp from projectile hits,
+        ally orders and the current animation frame size
+        """
+        units = self.units
+        n = units.count
+        state = np.array([(unit.hp, unit.target_x, unit.target_y, unit.image.get_width(), unit.image.get_height()) for unit in units.entities], dtype = float).reshape(n, 5)
+        units.hp[:n] = state[:, 0]
+        units.target[:n] = state[:, 1:3]
+        units.half_size[:n] = state[:, 3:5] // 2
+
+    def step(self, tick: int):
+        """
+        Targets, steers, separates, moves and resolves melee for every unit and moves every projectile,
+        then writes back to the objects
+        Hunters keep chasing the same prey until their retarget tick unless it dies
+        """
+        self.move_projectiles()
+        units = self.units
+        n = units.count
+        if n == 0:
+            return
+        self.gather()
+        pos = units.pos[:n]
+        vel = units.vel[:n]
+        hp = units.hp[:n]
+        faction = units.faction[:n]
+        living = hp > 0
+
+        # Enemies chase the closest living ally, looking again when it dies or their retarget tick comes
+        prey = np.flatnonzero(living & (faction == PREY))
+        hunters = np.flatnonzero(living & (faction == HUNTER))
+        if len(prey) and len(hunters):
+            chase = units.chase[:n]
+            retarget_tick = units.retarget_tick[:n]
+            chased = chase[hunters]
+            seeking = hunters[(chased < 0) | ~living[chased] | (retarget_tick[hunters] <= tick)]
+            if len(seeking):
+                chase[seeking] = prey[nearest(pos[prey], pos[seeking])]
+                # Like World.retarget(), hunters due together look again spread over the next retarget_ticks ticks
+                due = seeking[retarget_tick[seeking] <= tick]
+                retarget_tick[due] = tick + self.retarget_ticks + np.arange(len(due)) % self.retarget_ticks
+            units.target[hunters] = pos[chase[hunters]]
+
+        goal = units.target[:n] - units.half_size[:n]
+        delta = goal - pos
+        dx = delta[:, 0]
+        dy = delta[:, 1]
+        direction = np.where(dx != 0, np.arctan2(dy, dx), (dy > 0) * (math.pi/2) + (dy < 0) * (3*math.pi/2))
+        speed = units.speed[:n]
+        moving = living & (np.abs(dx) > speed) & (np.abs(dy) > speed)
+
+        # Separation from living units of the same faction within the avoid radius
+        steer = np.stack((np.cos(direction), np.sin(direction)), axis = 1)
+        i, j = neighbour_pairs(pos, self.avoid_radius)
+        away = pos[i] - pos[j]
+        dist = np.hypot(away[:, 0], away[:, 1])
+        close = (faction[i] == faction[j]) & living[i] & living[j] & (dist > 0) & (dist < self.avoid_radius)
+        i = i[close]
+        away = away[close] / dist[close, None]
+        steer[:, 0] += np.bincount(i, weights = away[:, 0], minlength = n)
+        steer[:, 1] += np.bincount(i, weights = away[:, 1], minlength = n)
+
+        length = np.hypot(steer[:, 0], steer[:, 1])
+        scale = np.divide(speed, length, out = np.zeros(n), where = length > 0)
+        vel[:] = np.where(moving[:, None], steer * scale[:, None], 0.0)
+        pos += vel
+        units.dir[:n] = direction
+
+        # Melee between overlapping rects of opposing factions, rects snap to whole pixels like pygame.Rect
+        corner = np.trunc(pos)
+        size = units.size[:n]
+        i, j = neighbour_pairs(corner, max(1.0, size.max()))
+        overlap = ((corner[i, 0] < corner[j, 0] + size[j, 0]) & (corner[j, 0] < corner[i, 0] + size[i, 0]) &
+                   (corner[i, 1] < corner[j, 1] + size[j, 1]) & (corner[j, 1] < corner[i, 1] + size[i, 1]))
+        hits = overlap & (faction[i] != faction[j]) & living[i] & living[j]
+        damage = np.bincount(j[hits], weights = units.atk[:n][i[hits]], minlength = n)
+        hp -= damage
+
+        self.scatter(damage > 0)
+
+    def scatter(self, damaged):
+        """
+        Copies the new movement state back to the objects, and hp only to the ones that were hit
+        """
+        units = self.units
+        n = units.count
+        for unit, (x, y), (vel_x, vel_y), (target_x, target_y), direction, hp, hit in zip(
+                units.entities, units.pos[:n].tolist(), units.vel[:n].tolist(), units.target[:n].tolist(), units.dir[:n].tolist(), units.hp[:n].tolist(), damaged.tolist()):
+            unit.x = x
+            unit.y = y
+            unit.vel_x = vel_x
+            unit.vel_y = vel_y
+            unit.target_x = target_x
+            unit.target_y = target_y
+            unit.dir = direction
+            unit.rect.topleft = (x, y)
+            if hit:
+                unit.hp = hp
+                unit.taking_damage = True
+
+    def move_projectiles(self):
+        """
+        Advances every projectile that is still in flight
+        """
+        projectiles = self.projectiles
+        n = projectiles.count
+        if n == 0:
+            return
+        flying = np.fromiter((projectile.flying() for projectile in projectiles.entities), dtype = bool, count = n)
+        pos = projectiles.pos[:n]
+        pos[flying] += projectiles.vel[:n][flying]
+        for projectile, (x, y), (vel_x, vel_y) in zip(compress(projectiles.entities, flying), pos[flying].tolist(), projectiles.vel[:n][flying].tolist()):
+            projectile.x = x
+            projectile.y = y
+            projectile.vel_x = vel_x
+            projectile.vel_y = vel_y
+            projectile.rect.update(x, y, projectile.rect.width, projectile.rect.height)
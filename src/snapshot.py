@@ -0,0 +1,118 @@
+"""
+Binary snapshots of a whole Battles world taken between two ticks: the options it was built with, coins, difficulty,
+the random generator, the attack timers and every entity, enough for main.restore() to carry on exactly
+as the original would have. Snapshots are what the rewind buffer keeps and what long sessions are checkpointed to
+
+Layout, little endian:
+    header    magic "BTLS", version u16, has seed u8, seed u64, engine u8, use grid u8, batch hits u8, retarget ticks u16,
+              difficulty ramp f64, tick u32, coins u32, difficulty f64, timers scheduled u32, grid max width u16,
+              grid max height u16, then the unit stats as UTF-8 JSON behind its length u32
+    random    624 u32 state words and position u32, has gauss u8, gauss f64
+    entities  count u32, then ENTITY each, in the order the world updates them
+    timers    count u32, then (tick u32, order u32, entity i32) each, in heap order
+"""
+
+import json
+import struct
+from array import array
+from itertools import starmap
+
+MAGIC = b"BTLS"
+VERSION = 1
+
+ENGINES = ("objects", "numpy")
+
+HEADER = struct.Struct("<4sHBQBBBHdIIdIHH")
+COUNT = struct.Struct("<I")
+GAUSS = struct.Struct("<Bd")
+TIMER = struct.Struct("<IIi")
+# Type index into main.ENTITY_TYPES, flags, position in its faction or projectile set, numpy engine slot or -1,
+# x, y, velocity x, velocity y, direction, speed, hp, atk, target x, target y, target entity or -1, retarget tick,
+# idle animation index or fireball frame index, run animation index, frame shown or -1 for the placeholder,
+# left and top of the rect it collides with
+ENTITY = struct.Struct("<BBiiddddddddddiIHHhii")
+
+# Entity flags
+TAKING_DAMAGE = 1
+COLLIDING = 2
+EXPLODING = 4
+
+class Snapshot:
+    """
+    One world state, filled in by main.World.snapshot() and read back by main.restore()
+    """
+    def __init__(self, seed, engine: str = "objects", use_grid: bool = True, batch_hits: bool = True,
+                 retarget_ticks: int = 10, difficulty_ramp: float = .1, unit_stats = None):
+        self.seed = seed
+        self.options = {"engine": engine, "use_grid": use_grid, "batch_hits": batch_hits,
+                        "retarget_ticks": retarget_ticks, "difficulty_ramp": difficulty_ramp}
+        self.unit_stats = unit_stats or {}
+        self.tick = 0
+        self.coins = 0
+        self.difficulty = 1.0
+        self.timers_scheduled = 0
+        self.grid_size = (0, 0) # Largest sprite the spatial grid has seen
+        self.random_state = None # random.Random.getstate()
+        self.entities = [] # ENTITY fields
+        self.timers = [] # (tick, order, entity)
+
+    def to_bytes(self):
+        options = self.options
+        stats = json.dumps(self.unit_stats).encode()
+        version, words, gauss = self.random_state
+        parts = [HEADER.pack(MAGIC, VERSION, self.seed is not None, self.seed or 0, ENGINES.index(options["engine"]),
+                             options["use_grid"], options["batch_hits"], options["retarget_ticks"], options["difficulty_ramp"],
+                             self.tick, self.coins, self.difficulty, self.timers_scheduled, *self.grid_size),
+                 COUNT.pack(len(stats)), stats,
+                 array("I", words).tobytes(), GAUSS.pack(gauss is not None, gauss or 0.0),
+                 COUNT.pack(len(self.entities))]
+        parts += starmap(ENTITY.pack, self.entities)
+        parts.append(COUNT.pack(len(self.timers)))
+        parts += [TIMER.pack(*timer) for timer in self.timers]
+        return b"".join(parts)
+
+    def save(self, path):
+        with open(path, "wb") as output:
+            output.write(self.to_bytes())
+
+def from_bytes(data, name: str = "snapshot"):
+    (magic, version, has_seed, seed, engine, use_grid, batch_hits, retarget_ticks, difficulty_ramp,
+     tick, coins, difficulty, timers_scheduled, grid_width, grid_height) = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(name + " is not a Battles snapshot")
+    if version != VERSION:
+        raise ValueError(name + " is snapshot version " + str(version) + ", only version " + str(VERSION) + " can be read")
+    offset = HEADER.size
+
+    length, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    unit_stats = json.loads(data[offset:offset + length].decode())
+    offset += length
+
+    saved = Snapshot(seed if has_seed else None, ENGINES[engine], bool(use_grid), bool(batch_hits), retarget_ticks, difficulty_ramp, unit_stats)
+    saved.tick = tick
+    saved.coins = coins
+    saved.difficulty = difficulty
+    saved.timers_scheduled = timers_scheduled
+    saved.grid_size = (grid_width, grid_height)
+
+    words = array("I")
+    words.frombytes(data[offset:offset + 625 * words.itemsize])
+    offset += 625 * words.itemsize
+    has_gauss, gauss = GAUSS.unpack_from(data, offset)
+    offset += GAUSS.size
+    saved.random_state = (3, tuple(words), gauss if has_gauss else None)
+
+    count, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    saved.entities = list(ENTITY.iter_unpack(data[offset:offset + count * ENTITY.size]))
+    offset += count * ENTITY.size
+
+    count, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    saved.timers = list(TIMER.iter_unpack(data[offset:offset + count * TIMER.size]))
+    return saved
+
+def load(path):
+    with open(path, "rb") as source:
+        return from_bytes(source.read(), path)
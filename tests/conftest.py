@@ -0,0 +1,51 @@
+"""
+Shared setup for the tests: runs pygame without a window and points the asset cache at placeholder images,
+since the real assets are not part of the repository
+"""
+
+import os
+import sys
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import pygame
+import pytest
+import main
+
+# Frame size of every unit, each gets 4 idle and 4 run frames
+UNIT_SIZES = {"imp": (16, 16), "wogol": (16, 20), "chort": (16, 24), "big_demon": (32, 36), "elf_m": (16, 28),
+              "knight_m": (16, 28), "wizard_m": (16, 28), "necromancer": (16, 20), "skeleton": (16, 16),
+              "elven_knight": (32, 32), "kingsguard": (32, 32)}
+
+def save_placeholder(path, size, colour):
+    image = pygame.Surface(size, pygame.SRCALPHA)
+    image.fill(colour)
+    pygame.image.save(image, path)
+
+@pytest.fixture(scope = "session")
+def placeholder_assets(tmp_path_factory):
+    """
+    A directory laid out like assets/ with a flat coloured image for every file the game loads
+    """
+    directory = tmp_path_factory.mktemp("assets")
+    os.makedirs(directory / "explosion_frames")
+    for unit, size in UNIT_SIZES.items():
+        for animation in ("idle", "run"):
+            for i in range(4):
+                save_placeholder(str(directory / (unit + "_" + animation + "_anim_f" + str(i) + ".png")), size, (40 * i, 100, 200, 255))
+    for i in range(64):
+        save_placeholder(str(directory / "explosion_frames" / ("explosion_f" + str(i) + ".png")), (32, 32), (255, 4 * i, 0, 255))
+    save_placeholder(str(directory / "crate.png"), (16, 16), (100, 60, 20, 255))
+    save_placeholder(str(directory / "dungeon.png"), (64, 64), (30, 30, 30, 255))
+    save_placeholder(str(directory / "coin.png"), (12, 15), (255, 215, 0, 255))
+    return str(directory)
+
+@pytest.fixture
+def assets(placeholder_assets, monkeypatch):
+    """
+    A fresh main.ASSETS reading the placeholder images
+    """
+    cache = main.AssetCache(placeholder_assets)
+    monkeypatch.setattr(main, "ASSETS", cache)
+    return cache
@@ -0,0 +1,36 @@
+"""
+The spatial grid and the nearest ally index are only a faster way to find the same sprites,
+so a battle has to play out exactly the same with World(use_grid = False), the brute force reference path
+"""
+
+import random
+import pytest
+import main
+
+TICKS = 600
+
+def crowded_battle(seed, use_grid):
+    """
+    A seeded battle with a crowd of allies packed in the middle and enemies arriving from every side
+    """
+    world = main.World(seed = seed, use_grid = use_grid)
+    world.difficulty = 25.0
+    rng = random.Random(seed)
+    for _ in range(30):
+        world.summon(rng.choice(main.SHOP), main.WIDTH//2 + rng.randint(-40, 40), main.HEIGHT//2 + rng.randint(-40, 40))
+    for _ in range(20):
+        world.summon(rng.choice((main.Knight, main.Elf, main.Wizard, main.Necromancer)), rng.randint(0, main.WIDTH), rng.choice((0, main.HEIGHT)))
+    return world
+
+@pytest.mark.parametrize("seed", range(3))
+def test_grid_matches_brute_force(assets, seed):
+    grid = crowded_battle(seed, use_grid = True)
+    brute_force = crowded_battle(seed, use_grid = False)
+    for tick in range(TICKS):
+        if tick == TICKS // 2:
+            grid.move_allies(main.WIDTH//4, main.HEIGHT//4)
+            brute_force.move_allies(main.WIDTH//4, main.HEIGHT//4)
+        grid.step()
+        brute_force.step()
+        assert grid.checksum() == brute_force.checksum(), "diverged on tick " + str(tick)
+    assert grid.coins > 0 # Enemies died in melee, so the grid answered real queries
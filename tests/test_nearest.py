@@ -0,0 +1,51 @@
+"""
+numpy_engine.nearest() has to agree with comparing every pair, and stay about as fast as that
+when the points are bunched up far from the queries, like idle allies stacked on the click point
+"""
+
+import time
+import pytest
+
+np = pytest.importorskip("numpy")
+import numpy_engine
+import main
+
+TIME_LIMIT = 0.25 # Seconds, comparing every pair takes about 10 ms
+
+def brute_force(points, queries):
+    return ((queries[:, None, :] - points[None, :, :]) ** 2).sum(axis = 2).argmin(axis = 1)
+
+def map_edge(rng, count):
+    """
+    Points spread along the border of the map, where enemies spawn
+    """
+    queries = rng.uniform(0, 1, (count, 2)) * (main.WIDTH, main.HEIGHT)
+    side = rng.integers(0, 4, count)
+    queries[side == 0, 0] = 0
+    queries[side == 1, 0] = main.WIDTH
+    queries[side == 2, 1] = 0
+    queries[side == 3, 1] = main.HEIGHT
+    return queries
+
+@pytest.mark.parametrize("spread", [0, 1, 40, 120])
+def test_clustered_points_far_from_queries(spread):
+    rng = np.random.default_rng(spread)
+    points = np.array((main.WIDTH/2, main.HEIGHT/2)) + rng.uniform(-spread/2, spread/2, (1500, 2))
+    queries = map_edge(rng, 200)
+    start = time.perf_counter()
+    found = numpy_engine.nearest(points, queries)
+    assert time.perf_counter() - start < TIME_LIMIT
+    assert (found == brute_force(points, queries)).all()
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 1, (2000, 2)) * (main.WIDTH, main.HEIGHT)
+    queries = rng.uniform(-0.5, 1.5, (1000, 2)) * (main.WIDTH, main.HEIGHT)
+    assert (numpy_engine.nearest(points, queries) == brute_force(points, queries)).all()
+
+def test_ties_go_to_the_lowest_index():
+    rng = np.random.default_rng(9)
+    points = rng.integers(0, 20, (1000, 2)).astype(float) # Many points share a position
+    queries = rng.integers(-30, 50, (1000, 2)).astype(float)
+    assert (numpy_engine.nearest(points, queries) == brute_force(points, queries)).all()
@@ -0,0 +1,39 @@
+"""
+Resolving projectile hits in one batched pass has to hit exactly what testing each projectile on its own did,
+so a battle has to play out the same with World(batch_hits = False), the per-projectile reference path
+"""
+
+import importlib.util
+import random
+import pytest
+import main
+
+TICKS = 600
+ENGINES = ["objects"] + (["numpy"] if importlib.util.find_spec("numpy") else [])
+
+def shooting_battle(seed, engine, batch_hits):
+    """
+    A seeded battle where elves and wizards ring a crowd of allies and shoot into it
+    """
+    world = main.World(seed = seed, engine = engine, batch_hits = batch_hits)
+    world.difficulty = 0.0 # Only the shooters placed here
+    rng = random.Random(seed)
+    for _ in range(25):
+        world.summon(rng.choice(main.SHOP), main.WIDTH//2 + rng.randint(-60, 60), main.HEIGHT//2 + rng.randint(-60, 60))
+    for _ in range(30):
+        world.summon(rng.choice((main.Elf, main.Wizard)), rng.randint(0, main.WIDTH), rng.choice((0, main.HEIGHT)))
+    return world
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("seed", range(2))
+def test_batched_hits_match_per_projectile_hits(assets, engine, seed):
+    batched = shooting_battle(seed, engine, batch_hits = True)
+    reference = shooting_battle(seed, engine, batch_hits = False)
+    fired = 0
+    for tick in range(TICKS):
+        batched.step()
+        reference.step()
+        fired = max(fired, len(batched.registry.projectiles))
+        assert batched.checksum() == reference.checksum(), "diverged on tick " + str(tick)
+    assert fired > 0
+    assert len(batched.registry.factions[main.ALLY]) < 30 # Allies were shot down
@@ -0,0 +1,109 @@
+"""
+Once warm_assets() has baked every frame variant, drawing a battle must not create a single surface,
+whichever way units face and whether they are taking damage
+"""
+
+import math
+import sys
+from collections import Counter
+import pygame
+import main
+
+FRAMES = 300
+SURFACE_METHODS = {"copy", "convert", "convert_alpha", "subsurface", "premul_alpha"} # Surface methods that return a new surface
+ALLOCATING_MODULES = {"pygame.transform", "pygame.image"} # Every function of these makes a surface, e.g. flip() and load()
+
+class SurfaceCounter:
+    """
+    Counts every call that makes a surface while it is active: pygame.Surface(), the allocating Surface methods,
+    pygame.transform and pygame.image functions and Font.render(), whoever calls them
+    """
+    def __init__(self, monkeypatch):
+        self.calls = Counter() # name -> calls
+        self.active = False
+        counter = self
+
+        class CountedSurface(pygame.Surface):
+            def __init__(self, *args, **kwargs):
+                if counter.active:
+                    counter.calls["Surface"] += 1
+                super().__init__(*args, **kwargs)
+        monkeypatch.setattr(pygame, "Surface", CountedSurface)
+
+    def profile(self, frame, event, function):
+        # Surface methods cannot be patched, pygame.Surface is an immutable type, so watch calls into C instead
+        if event != "c_call":
+            return
+        owner = getattr(function, "__self__", None)
+        if ((isinstance(owner, pygame.surface.Surface) and function.__name__ in SURFACE_METHODS) or
+                getattr(function, "__module__", None) in ALLOCATING_MODULES or
+                (isinstance(owner, pygame.font.Font) and function.__name__ == "render")):
+            self.calls[function.__name__] += 1
+
+    def __enter__(self):
+        self.active = True
+        sys.setprofile(self.profile)
+        return self.calls
+
+    def __exit__(self, *exc):
+        sys.setprofile(None)
+        self.active = False
+
+def draw_battle(window, counter):
+    """
+    Runs and draws FRAMES ticks of a crowded battle, returns the id of every frame drawn
+    """
+    world = main.World(seed = 5)
+    world.difficulty = 10.0 # Plenty of enemies of every type, firing and summoning
+    for i in range(20):
+        world.summon(main.Chort, main.WIDTH//2 + i, main.HEIGHT//2)
+    world.move_allies(0, main.HEIGHT//2) # Everyone runs left
+
+    queue = main.RenderQueue()
+    drawn = set()
+    for frame in range(FRAMES):
+        world.step()
+        with counter:
+            for entity in world.registry.all:
+                if isinstance(entity, main.Sprite) and frame % 2:
+                    entity.dir = math.pi # Facing left
+                    entity.taking_damage = True
+                entity.submit(queue)
+            drawn.update(map(id, (surface for _, surface, _ in queue.sprites)))
+            queue.flush(window)
+    return drawn
+
+def test_drawing_a_battle_allocates_no_surfaces(assets, monkeypatch):
+    window = pygame.display.set_mode((main.WIDTH, main.HEIGHT))
+    try:
+        main.warm_assets()
+        before = assets.surfaces_created
+        counter = SurfaceCounter(monkeypatch)
+        drawn = draw_battle(window, counter)
+
+        assert counter.calls == Counter()
+        assert assets.surfaces_created == before
+        flipped_tinted = {id(variants[main.FLIPPED_TINTED]) for variants in assets.variants.values()}
+        assert drawn & flipped_tinted
+    finally:
+        pygame.display.quit()
+
+def test_counter_sees_a_copy_per_frame(assets, monkeypatch):
+    """
+    The counter has to catch a sprite that flips a fresh copy of its frame every time it is drawn
+    """
+    window = pygame.display.set_mode((main.WIDTH, main.HEIGHT))
+    try:
+        main.warm_assets()
+        submit = main.Sprite.submit
+        def copying_submit(self, queue):
+            pygame.transform.flip(self.image.copy(), True, False)
+            submit(self, queue)
+        monkeypatch.setattr(main.Sprite, "submit", copying_submit)
+        counter = SurfaceCounter(monkeypatch)
+        draw_battle(window, counter)
+
+        assert counter.calls["copy"] > 0
+        assert counter.calls["flip"] == counter.calls["copy"]
+    finally:
+        pygame.display.quit()
@@ -0,0 +1,43 @@
+"""
+Rewind takes a snapshot every interval ticks, but holds a due one back while the frame has no time left for it
+"""
+
+import main
+
+def test_snapshot_waits_for_a_frame_with_time(assets):
+    world = main.World(seed = 11)
+    rewind = main.Rewind(interval = 10)
+    rewind.cost = 0.005
+    for _ in range(10):
+        world.step()
+        rewind.record(world, 0.001) # Frame over budget
+    assert not rewind.snapshots
+    world.step()
+    rewind.record(world, 1.0)
+    assert [tick for tick, _ in rewind.snapshots] == [11]
+
+def test_late_snapshot_is_taken_anyway(assets):
+    world = main.World(seed = 11)
+    rewind = main.Rewind(interval = 10)
+    rewind.cost = 0.005
+    for _ in range(20):
+        world.step()
+        rewind.record(world, 0.0)
+    assert [tick for tick, _ in rewind.snapshots] == [20]
+
+def test_rewind_restores_an_earlier_tick(assets):
+    world = main.World(seed = 11)
+    rewind = main.Rewind(interval = 10)
+    for _ in range(25):
+        world.step()
+        rewind.record(world)
+    earlier = rewind.rewind(world)
+    assert earlier.tick == 20
+    assert earlier.snapshot().to_bytes() == rewind_target(20)
+    assert rewind.next_tick == 30
+
+def rewind_target(ticks):
+    world = main.World(seed = 11)
+    for _ in range(ticks):
+        world.step()
+    return world.snapshot().to_bytes()
@@ -0,0 +1,73 @@
+"""
+World.schedule_attack() has to time attacks like the per-tick roll it replaced, where every tick a unit attacked
+with a 1 in attack_ticks chance, so the wait in ticks until its next attack is geometric with p = 1 / attack_ticks
+"""
+
+import heapq
+import math
+import pytest
+import main
+
+SAMPLES = 20000
+BINS = 10
+CHI2_LIMIT = 27.88 # 9 degrees of freedom, exceeded by chance once in 1000
+
+def draw_waits(world, unit, count):
+    """
+    Ticks from scheduling to the attack for count timers scheduled at tick 0
+    """
+    world.timers = []
+    waits = []
+    for _ in range(count):
+        world.schedule_attack(unit, 0)
+        waits.append(heapq.heappop(world.timers)[0])
+    return waits
+
+def geometric_bins(p, bins):
+    """
+    Splits the waits into bins of roughly equal probability, returns their (first, last + 1) with the last one open ended
+    """
+    edges = [0]
+    for i in range(1, bins):
+        # Smallest wait k with P(wait < k) >= i / bins
+        edges.append(max(edges[-1] + 1, math.ceil(math.log(1 - i / bins) / math.log(1 - p))))
+    edges.append(math.inf)
+    return list(zip(edges, edges[1:]))
+
+@pytest.mark.parametrize("unit_type", [main.Elf, main.Wizard, main.Necromancer])
+def test_waits_follow_the_per_tick_roll(assets, unit_type):
+    world = main.World(seed = 7)
+    unit = world.create(unit_type, 0, 0)
+    p = 1 / unit.attack_ticks
+    waits = draw_waits(world, unit, SAMPLES)
+
+    # Mean of the geometric distribution is (1 - p) / p, within 4 standard errors
+    mean = sum(waits) / SAMPLES
+    error = math.sqrt(1 - p) / p / math.sqrt(SAMPLES)
+    assert abs(mean - (1 - p) / p) < 4 * error
+
+    chi2 = 0.0
+    for first, end in geometric_bins(p, BINS):
+        expected = SAMPLES * ((1 - p) ** first - (1 - p) ** end if end != math.inf else (1 - p) ** first)
+        observed = sum(1 for wait in waits if first <= wait < end)
+        chi2 += (observed - expected) ** 2 / expected
+    assert chi2 < CHI2_LIMIT
+
+def test_timers_fire_as_often_as_rolls(assets):
+    """
+    Over a long run a unit attacks once per attack_ticks ticks on average, like rolling randint(1, attack_ticks) == 1 every tick
+    """
+    world = main.World(seed = 3)
+    unit = world.create(main.Elf, 0, 0)
+    ticks = 200 * unit.attack_ticks
+    attacks = 0
+    world.timers = []
+    world.schedule_attack(unit, 0)
+    while True:
+        tick = heapq.heappop(world.timers)[0]
+        if tick >= ticks:
+            break
+        attacks += 1
+        world.schedule_attack(unit, tick + 1)
+    expected = ticks / unit.attack_ticks
+    assert abs(attacks - expected) < 4 * math.sqrt(expected)
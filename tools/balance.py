@@ -0,0 +1,173 @@
+"""
+Monte Carlo balance runner, plays many seeded headless battles over a grid of unit stats across every core
+Run from the repository root so the assets folder is found, e.g.
+    python tools/balance.py --grid Imp.hp=2,3,4 --grid difficulty_ramp=.1,.2 --policy rotate,imps --seeds 50
+Writes one row per battle to --out and the mean of every configuration to the same name ending in _summary.csv
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import main
+
+SAMPLE_TICKS = main.FPS # How often the number of units alive is recorded
+ORDER_TICKS = 10 # How often the army is sent at the enemy closest to it
+SHOP = main.SHOP # Cheapest first
+
+# Spawn policies, called every tick with the world, return the unit type to buy or None
+def imps(world):
+    return main.Imp
+
+def rotate(world):
+    """
+    Saves up for the next unit in the shop by army size, so the army ends up a mix of everything
+    """
+    return SHOP[len(world.registry.factions[main.ALLY]) % len(SHOP)]
+
+def saver(world):
+    """
+    Saves up for big demons, only buying imps when about to lose
+    """
+    if len(world.registry.factions[main.ALLY]) <= 1:
+        return main.Imp
+    return main.Big_Demon
+
+POLICIES = {"imps": imps, "rotate": rotate, "saver": saver}
+
+def command(world):
+    """
+    Sends every ally at the enemy closest to the middle of the army, like a player clicking on it
+    """
+    allies = world.registry.factions[main.ALLY]
+    enemies = world.registry.factions[main.ENEMY]
+    if not len(allies) or not len(enemies):
+        return
+    x = sum(ally.x for ally in allies) / len(allies)
+    y = sum(ally.y for ally in allies) / len(allies)
+    closest = min(enemies, key = lambda enemy: (enemy.x - x) ** 2 + (enemy.y - y) ** 2)
+    world.move_allies(*closest.rect.center)
+
+def configure(parameters):
+    """
+    Splits {"Imp.hp": 3.0, "difficulty_ramp": .2} into World keyword arguments
+    """
+    unit_stats = {}
+    options = {}
+    for name, value in parameters.items():
+        if "." in name:
+            unit, attribute = name.split(".", 1)
+            unit_stats.setdefault(unit, {})[attribute] = value
+        else:
+            options[name] = value
+    return dict(options, unit_stats = unit_stats)
+
+def battle(job):
+    """
+    Plays one battle until every ally is dead and none can be bought, or max_ticks runs out
+    The policy decides what to buy, the army always attacks
+    """
+    seed, policy, parameters, max_ticks, engine = job
+    world = main.World(seed = seed, engine = engine, **configure(parameters))
+    spend = POLICIES[policy]
+    spent = 0
+    peak_difficulty = world.difficulty
+    allies_alive = []
+    enemies_alive = []
+    while world.tick < max_ticks:
+        unit_type = spend(world)
+        if unit_type is not None and world.buy(unit_type):
+            spent += world.cost(unit_type)
+        if world.tick % ORDER_TICKS == 0:
+            command(world)
+        world.step()
+        peak_difficulty = max(peak_difficulty, world.difficulty)
+        allies = len(world.registry.factions[main.ALLY])
+        if world.tick % SAMPLE_TICKS == 0:
+            allies_alive.append(allies)
+            enemies_alive.append(len(world.registry.factions[main.ENEMY]))
+        if allies == 0 and world.coins < min(world.cost(unit_type) for unit_type in SHOP):
+            break
+
+    row = {"seed": seed, "policy": policy}
+    row.update(parameters)
+    row.update({"survival_ticks": world.tick,
+                "survived": world.tick >= max_ticks,
+                "coins_earned": world.coins + spent,
+                "peak_difficulty": round(peak_difficulty, 3),
+                "mean_allies_alive": round(sum(allies_alive) / len(allies_alive), 3) if allies_alive else 0.0,
+                "allies_alive": " ".join(map(str, allies_alive)),
+                "enemies_alive": " ".join(map(str, enemies_alive))})
+    return row
+
+def parse_grid(specs):
+    """
+    ["Imp.hp=2,3", "difficulty_ramp=.1"] -> [{"Imp.hp": 2.0, "difficulty_ramp": .1}, {"Imp.hp": 3.0, "difficulty_ramp": .1}]
+    """
+    names = []
+    values = []
+    for spec in specs:
+        name, options = spec.split("=", 1)
+        names.append(name)
+        values.append([float(value) for value in options.split(",")])
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+SUMMED = ("survival_ticks", "survived", "coins_earned", "peak_difficulty", "mean_allies_alive")
+
+def summarize(rows, keys):
+    """
+    Means of the outcomes of every run sharing the same policy and parameters
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[key] for key in keys), []).append(row)
+    summary = []
+    for group, runs in groups.items():
+        line = dict(zip(keys, group))
+        line["runs"] = len(runs)
+        for outcome in SUMMED:
+            line[outcome] = round(sum(float(run[outcome]) for run in runs) / len(runs), 3)
+        summary.append(line)
+    return summary
+
+def write_csv(path, rows):
+    with open(path, "w", newline = "") as output:
+        writer = csv.DictWriter(output, fieldnames = list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def main_balance():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grid", action = "append", default = [], help = "Unit.argument=v1,v2 for a constructor argument or cost, or World option=v1,v2, repeatable")
+    parser.add_argument("--policy", default = "imps", help = "Comma separated, any of " + ", ".join(POLICIES))
+    parser.add_argument("--seeds", type = int, default = 20, help = "Battles per configuration")
+    parser.add_argument("--max-ticks", type = int, default = 60 * main.FPS)
+    parser.add_argument("--engine", default = "objects")
+    parser.add_argument("--workers", type = int, default = os.cpu_count())
+    parser.add_argument("--out", default = "balance.csv")
+    args = parser.parse_args()
+
+    policies = args.policy.split(",")
+    grid = parse_grid(args.grid)
+    jobs = [(seed, policy, parameters, args.max_ticks, args.engine)
+            for parameters in grid for policy in policies for seed in range(args.seeds)]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers) as pool:
+        rows = list(pool.map(battle, jobs, chunksize = max(1, len(jobs) // (args.workers * 8))))
+    elapsed = time.perf_counter() - start
+
+    write_csv(args.out, rows)
+    summary = summarize(rows, ["policy"] + list(grid[0]))
+    write_csv(os.path.splitext(args.out)[0] + "_summary.csv", summary)
+    for line in summary:
+        print(line)
+    print(len(rows), "battles in", round(elapsed, 2), "s,", round(len(rows) / elapsed, 2), "runs/s on", args.workers, "workers")
+
+if __name__ == "__main__":
+    main_balance()
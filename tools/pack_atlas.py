@@ -0,0 +1,87 @@
+"""
+Packs the unit and effect frames in assets/ into a few sprite sheets plus an index of where each frame went
+Run from the repository root after changing any frame: python tools/pack_atlas.py
+The game picks the sheets up from assets/atlas/ by itself and falls back to the loose files without them
+"""
+
+import json
+import os
+import sys
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+
+ASSETS = "assets"
+ATLAS = "atlas" # Folder inside assets/ for the sheets and index
+INDEX = "atlas.json"
+SHEET_SIZE = 1024
+MAX_FRAME_SIZE = 256 # Anything bigger, like the background, is left as its own file
+PADDING = 1
+
+def find_frames(directory):
+    """
+    Returns {path relative to assets/ with / separators: surface} for every png small enough to pack
+    """
+    frames = {}
+    for root, folders, files in os.walk(directory):
+        folders[:] = sorted(folder for folder in folders if folder != ATLAS)
+        for name in sorted(files):
+            if not name.endswith(".png"):
+                continue
+            path = os.path.join(root, name)
+            image = pygame.image.load(path)
+            if image.get_width() <= MAX_FRAME_SIZE and image.get_height() <= MAX_FRAME_SIZE:
+                frames[os.path.relpath(path, directory).replace(os.sep, "/")] = image
+    return frames
+
+def pack(frames):
+    """
+    Shelf packs the frames tallest first, starting a new sheet whenever one fills up
+    Returns (sheet sizes, {path: [sheet, x, y, width, height]})
+    """
+    order = sorted(frames, key = lambda path: (-frames[path].get_height(), -frames[path].get_width(), path))
+    sheets = []
+    rects = {}
+    x = y = shelf_height = 0
+    for path in order:
+        width, height = frames[path].get_size()
+        if x + width > SHEET_SIZE: # Next shelf
+            x = 0
+            y += shelf_height + PADDING
+            shelf_height = 0
+        if not sheets or y + height > SHEET_SIZE: # Next sheet
+            sheets.append([0, 0])
+            x = y = shelf_height = 0
+        rects[path] = [len(sheets) - 1, x, y, width, height]
+        sheet = sheets[-1]
+        sheet[0] = max(sheet[0], x + width)
+        sheet[1] = max(sheet[1], y + height)
+        x += width + PADDING
+        shelf_height = max(shelf_height, height)
+    return sheets, rects
+
+def main():
+    pygame.init()
+    frames = find_frames(ASSETS)
+    if not frames:
+        sys.exit("No frames found, run from the repository root")
+    sizes, rects = pack(frames)
+
+    output = os.path.join(ASSETS, ATLAS)
+    os.makedirs(output, exist_ok = True)
+    names = []
+    for i, size in enumerate(sizes):
+        sheet = pygame.Surface(size, pygame.SRCALPHA)
+        sheet.fill((0, 0, 0, 0))
+        for path, (sheet_index, x, y, width, height) in rects.items():
+            if sheet_index == i:
+                sheet.blit(frames[path], (x, y), special_flags = pygame.BLEND_RGBA_MAX) # Copies the pixels exactly, alpha included
+        names.append("sheet" + str(i) + ".png")
+        pygame.image.save(sheet, os.path.join(output, names[-1]))
+
+    with open(os.path.join(output, INDEX), "w") as index:
+        json.dump({"sheets": names, "frames": rects}, index, separators = (",", ":"))
+    print("Packed", len(frames), "frames into", len(names), "sheets in", output)
+
+if __name__ == "__main__":
+    main()